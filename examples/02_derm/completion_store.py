@@ -0,0 +1,163 @@
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+
+class CompletionStore(ABC):
+    """
+    Which questions each session has completed, per question set.
+
+    Completions are a bitset over question positions (bit i = the i-th question
+    of the set), kept as a Python int: 828 questions fit in ~110 bytes and a
+    check is one shift. Every bitset is stored with the version of the
+    question set it was built against; if the file changes and positions
+    move, the old bits are ignored instead of being applied to the wrong questions.
+
+    Sessions idle for longer than `ttl_seconds` are forgotten.
+    """
+
+    @abstractmethod
+    def get(self, session_id: str, question_set: str, version: str) -> int:
+        """The completion bitset, 0 if there is none (or it belongs to another version)."""
+
+    @abstractmethod
+    def add(self, session_id: str, question_set: str, version: str, position: int) -> None:
+        """Mark the question at `position` completed."""
+
+    @abstractmethod
+    def reset(self, session_id: str, question_set: str) -> None:
+        """Forget every completion of a session for one question set."""
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryCompletionStore(CompletionStore):
+    """Per-process store, bounded by `max_sessions` (least recently used evicted first) and the TTL."""
+
+    def __init__(self, ttl_seconds: float, max_sessions: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        # (session_id, question_set) -> (version, bits, last used); least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self, now):
+        while self._entries:
+            key, (_, _, touched) = next(iter(self._entries.items()))
+            if touched >= now - self.ttl_seconds and len(self._entries) <= self.max_sessions:
+                break
+            del self._entries[key]
+
+    def get(self, session_id, question_set, version):
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            entry = self._entries.get((session_id, question_set))
+            if entry is None or entry[0] != version:
+                return 0
+            self._entries[(session_id, question_set)] = (version, entry[1], now)
+            self._entries.move_to_end((session_id, question_set))
+            return entry[1]
+
+    def add(self, session_id, question_set, version, position):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((session_id, question_set))
+            bits = entry[1] if entry is not None and entry[0] == version else 0
+            self._entries[(session_id, question_set)] = (version, bits | (1 << position), now)
+            self._entries.move_to_end((session_id, question_set))
+            self._evict(now)
+
+    def reset(self, session_id, question_set):
+        with self._lock:
+            self._entries.pop((session_id, question_set), None)
+
+
+class SQLiteCompletionStore(CompletionStore):
+    """
+    Store in a SQLite file, so every uvicorn worker (and restarts) see the same
+    completions. Memory use does not grow with the number of sessions.
+    """
+
+    # Expired rows are purged after this many writes
+    PURGE_EVERY = 1000
+
+    def __init__(self, path: str, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # isolation_level=None: transactions are opened explicitly below
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        # WAL lets workers read while another one writes
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            " session_id TEXT NOT NULL,"
+            " question_set TEXT NOT NULL,"
+            " version TEXT NOT NULL,"
+            " bits BLOB NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (session_id, question_set))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS completions_updated_at ON completions (updated_at)")
+        self._purge()
+
+    def _purge(self):
+        self.conn.execute("DELETE FROM completions WHERE updated_at < ?", (time.time() - self.ttl_seconds,))
+
+    def get(self, session_id, question_set, version):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT bits FROM completions"
+                " WHERE session_id = ? AND question_set = ? AND version = ? AND updated_at >= ?",
+                (session_id, question_set, version, time.time() - self.ttl_seconds),
+            ).fetchone()
+        return int.from_bytes(row[0], "little") if row else 0
+
+    def add(self, session_id, question_set, version, position):
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock up front, so concurrent workers can't lose each other's bits
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "SELECT bits FROM completions"
+                    " WHERE session_id = ? AND question_set = ? AND version = ? AND updated_at >= ?",
+                    (session_id, question_set, version, now - self.ttl_seconds),
+                ).fetchone()
+                bits = (int.from_bytes(row[0], "little") if row else 0) | (1 << position)
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO completions (session_id, question_set, version, bits, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (session_id, question_set, version, bits.to_bytes((bits.bit_length() + 7) // 8, "little"), now),
+                )
+                self._writes += 1
+                if self._writes % self.PURGE_EVERY == 0:
+                    self._purge()
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def reset(self, session_id, question_set):
+        with self._lock:
+            self.conn.execute(
+                "DELETE FROM completions WHERE session_id = ? AND question_set = ?", (session_id, question_set)
+            )
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+def completion_store_from_env() -> CompletionStore:
+    """COMPLETION_STORE=memory (default) or sqlite, with COMPLETION_TTL_HOURS, COMPLETION_MAX_SESSIONS and COMPLETION_DB_PATH."""
+    ttl_seconds = float(os.getenv("COMPLETION_TTL_HOURS", "72")) * 3600
+    if os.getenv("COMPLETION_STORE", "memory") == "sqlite":
+        return SQLiteCompletionStore(os.getenv("COMPLETION_DB_PATH", "data/completions.db"), ttl_seconds)
+    return MemoryCompletionStore(ttl_seconds, int(os.getenv("COMPLETION_MAX_SESSIONS", "100000")))
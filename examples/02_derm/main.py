@@ -1,16 +1,34 @@
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
+import hashlib
 import json
-import pathlib
-from typing import Dict, Set
-from collections import defaultdict
+from typing import Optional
 
-app = FastAPI()
+from completion_store import completion_store_from_env
+from question_bank import QuestionBank, to_json_bytes
 
-# Store completion status per session using question content hash as ID
-# Format: { session_id: { question_set: set(completed_question_hashes) } }
-session_completions: Dict[str, Dict[str, Set[str]]] = defaultdict(lambda: defaultdict(set))
+# Question files by set name; any other question_set falls back to "genetic"
+QUESTION_FILES = {
+    "original": "static/questions.json",
+    "genetic": "genetic_questions.json",
+}
+
+@asynccontextmanager
+async def lifespan(app):
+    # Parse the question sets once at startup instead of on every request
+    question_bank.load_all()
+    yield
+    completion_store.close()
+
+app = FastAPI(lifespan=lifespan)
+
+# Completion status per session and question set, as a bitset over question positions
+# In memory by default (bounded, idle sessions expire); COMPLETION_STORE=sqlite shares it between workers,
+# e.g. COMPLETION_STORE=sqlite uvicorn main:app --workers 4
+completion_store = completion_store_from_env()
 
 # Enable CORS for local frontend dev
 app.add_middleware(
@@ -35,38 +53,102 @@ async def serve_quiz_alt():
     return FileResponse("static/sce/index.html")
 
 def get_question_id(question):
-    """Generate a unique ID for a question based on its content"""
-    return str(hash(question["question"] + str(question["choices"]) + str(question["correct"])))
+    """
+    Generate a unique ID for a question based on its content.
+    A digest rather than hash(), which is randomized per process: the same
+    question gets the same ID after a restart and in every uvicorn worker.
+    """
+    content = json.dumps([question["question"], question["choices"], question["correct"]], ensure_ascii=False)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
 
-@app.get("/sce/api/questions")
-def se_questions(question_set: str = "genetic", session_id: str = None):
+# Parsed question sets with their IDs, reloaded only when a file's mtime changes
+question_bank = QuestionBank(QUESTION_FILES, get_question_id)
+
+def load_question_set(question_set):
+    """Cached questions for a set; IDs are computed once per load"""
     try:
-        # Load questions
-        if question_set == "original":
-            questions = json.load(pathlib.Path("static/questions.json").open())
-        else:  # default to genetic
-            questions = json.load(pathlib.Path("genetic_questions.json").open())
-        
-        # Add unique IDs to questions
-        for q in questions:
-            q["id"] = get_question_id(q)
-        
-        if not session_id:
-            return questions
-
-        # Get completed question IDs for this session and question set
-        completed_ids = session_completions[session_id][question_set]
-        
-        # Separate incomplete and complete questions
-        incomplete = [q for q in questions if q["id"] not in completed_ids]
-        complete = [q for q in questions if q["id"] in completed_ids]
-        
-        # Return incomplete questions first, then complete ones
-        return incomplete + complete
-
-    except FileNotFoundError as e:
+        return question_bank.get("original" if question_set == "original" else "genetic")
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail=f"Question set '{question_set}' not found")
 
+# Fields a client can ask for with ?fields=
+QUESTION_FIELDS = ("id", "question", "choices", "correct", "explanation")
+
+def parse_fields(fields):
+    """?fields=id,question,... as a tuple of field names; None means every field"""
+    if fields is None:
+        return None
+    names = tuple(name.strip() for name in fields.split(",") if name.strip())
+    unknown = [name for name in names if name not in QUESTION_FIELDS]
+    if unknown or not names:
+        raise HTTPException(status_code=400, detail=f"fields must be a comma-separated subset of {', '.join(QUESTION_FIELDS)}")
+    return names
+
+def parse_cursor(cursor):
+    """A cursor is "<pass>.<position>": where the incomplete (0) or complete (1) pass resumes"""
+    if cursor is None:
+        return 0, 0
+    try:
+        phase, position = (int(part) for part in cursor.split("."))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if phase not in (0, 1) or position < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return phase, position
+
+def incomplete_first(count, completed, phase=0, start=0):
+    """
+    Yield (pass, position) for every question, incomplete ones first, each
+    group in file order, resuming at `start` in pass `phase`. One scan over the
+    completion bitset; nothing is sorted or copied.
+    """
+    done = format(completed, "b")[::-1]  # done[i] == "1" if question i is completed
+    for p in range(phase, 2):
+        for i in range(start if p == phase else 0, count):
+            if (i < len(done) and done[i] == "1") == bool(p):
+                yield p, i
+
+@app.get("/sce/api/questions")
+def se_questions(
+    question_set: str = "genetic",
+    session_id: str = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    loaded = load_question_set(question_set)
+    projection = parse_fields(fields)
+    paged = limit is not None or cursor is not None
+
+    # Without a session, paging or projection the response is the same for everyone: send the pre-serialized bytes
+    if not session_id and not paged and projection is None:
+        return Response(content=loaded.body, media_type="application/json")
+
+    # Get the completed-question bitset for this session and question set (none without a session)
+    completed = completion_store.get(session_id, question_set, loaded.version) if session_id else 0
+
+    # Incomplete questions first, then complete ones, stopping after `limit`
+    items = []
+    next_cursor = None
+    for phase, i in incomplete_first(len(loaded.questions), completed, *parse_cursor(cursor)):
+        if limit is not None and len(items) == limit:
+            next_cursor = f"{phase}.{i}"
+            break
+        if projection is None:
+            items.append(loaded.encoded[i])
+        else:
+            q = loaded.questions[i]
+            items.append(to_json_bytes({name: q[name] for name in projection if name in q}))
+    questions = b"[" + b",".join(items) + b"]"
+
+    # Unpaged requests keep returning a plain list
+    if not paged:
+        return Response(content=questions, media_type="application/json")
+    body = (b'{"questions":' + questions + b',"next_cursor":' + to_json_bytes(next_cursor)
+            + b',"total":' + str(len(loaded.questions)).encode()
+            + b',"completed":' + str(bin(completed).count("1")).encode() + b"}")
+    return Response(content=body, media_type="application/json")
+
 @app.post("/sce/api/complete-question")
 async def complete_question(request: Request):
     data = await request.json()
@@ -76,9 +158,15 @@ async def complete_question(request: Request):
     
     if not session_id or not question_id:
         raise HTTPException(status_code=400, detail="Missing session_id or question_id")
+
+    # O(1) lookup in the set's ID table; reject IDs that are not in the current questions
+    loaded = load_question_set(question_set)
+    position = loaded.positions.get(question_id)
+    if position is None:
+        raise HTTPException(status_code=404, detail=f"Unknown question_id '{question_id}'")
     
-    # Mark question as completed
-    session_completions[session_id][question_set].add(question_id)
+    # Mark question as completed (off the event loop: the SQLite store writes to disk)
+    await run_in_threadpool(completion_store.add, session_id, question_set, loaded.version, position)
     return {"status": "success"}
 
 @app.post("/sce/api/reset-completion")
@@ -91,7 +179,7 @@ async def reset_completion(request: Request):
         raise HTTPException(status_code=400, detail="Missing session_id")
     
     # Clear completion status for the question set
-    session_completions[session_id][question_set].clear()
+    await run_in_threadpool(completion_store.reset, session_id, question_set)
     return {"status": "success"}
     
 
@@ -0,0 +1,75 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List
+
+
+def to_json_bytes(value) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class QuestionSet:
+    """One parsed question file: the questions with their IDs, an ID → position table and the ready-to-send JSON body."""
+
+    def __init__(self, questions: List[dict], mtime_ns: int):
+        self.questions = questions
+        self.mtime_ns = mtime_ns
+        self.positions: Dict[str, int] = {}
+        for position, q in enumerate(questions):
+            # A question that appears twice keeps its first position
+            self.positions.setdefault(q["id"], position)
+        # Identifies this exact list of questions; completion bitsets are only valid for the same version
+        self.version = hashlib.sha256(" ".join(q["id"] for q in questions).encode("utf-8")).hexdigest()[:16]
+        # Same bytes FastAPI's JSONResponse would produce, serialized once per load,
+        # per question (to assemble pages and session orderings) and for the whole set
+        self.encoded = [to_json_bytes(q) for q in questions]
+        self.body = b"[" + b",".join(self.encoded) + b"]"
+
+
+class QuestionBank:
+    """
+    Question sets parsed once and kept in memory.
+
+    Each file is re-read only when its modification time changes, and the
+    mtime itself is checked at most once every `check_interval` seconds, so a
+    request normally does no file I/O and no parsing at all.
+    """
+
+    def __init__(self, paths: Dict[str, str], question_id: Callable[[dict], str], check_interval: float = 1.0):
+        self.paths = paths
+        self.question_id = question_id
+        self.check_interval = check_interval
+        self._sets: Dict[str, QuestionSet] = {}
+        self._checked: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def load_all(self):
+        """Parse every configured set now (e.g. at startup); missing files are skipped."""
+        for name in self.paths:
+            try:
+                self.get(name)
+            except FileNotFoundError:
+                pass
+
+    def get(self, name: str) -> QuestionSet:
+        """Return the current questions for `name`. Raises FileNotFoundError if its file is missing."""
+        question_set = self._sets.get(name)
+        now = time.monotonic()
+        if question_set is not None and now - self._checked.get(name, 0.0) < self.check_interval:
+            return question_set
+        with self._lock:
+            self._checked[name] = now
+            mtime_ns = os.stat(self.paths[name]).st_mtime_ns
+            question_set = self._sets.get(name)
+            if question_set is None or question_set.mtime_ns != mtime_ns:
+                question_set = self._sets[name] = self._load(name, mtime_ns)
+            return question_set
+
+    def _load(self, name: str, mtime_ns: int) -> QuestionSet:
+        with open(self.paths[name], "r", encoding="utf-8") as f:
+            questions = json.load(f)
+        for q in questions:
+            q["id"] = self.question_id(q)
+        return QuestionSet(questions, mtime_ns)
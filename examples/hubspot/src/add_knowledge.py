@@ -6,13 +6,38 @@ import os
 from dotenv import load_dotenv
 # Import csv for loading CSV data
 import csv
+# Import argparse for command-line options
+import argparse
+# Import the batching helper that sends documents in bulk
+from batch_indexer import BatchIndexer
+# Import the manifest used to skip documents that have not changed since the last run
+from manifest import IndexManifest, content_hash, delete_missing_documents, stable_doc_id
+# Import the progress log that makes interrupted runs resumable
+from progress_log import ProgressLog
+# Import the index version used to invalidate the apps' retrieval caches
+from retrieval_cache import bump_index_version
+
+# Parse command-line options
+parser = argparse.ArgumentParser(description="Index HubSpot activities into DuckyAI")
+parser.add_argument("--delete-missing", action="store_true",
+                    help="delete documents whose activity no longer appears in the CSV")
+parser.add_argument("--resume", action="store_true",
+                    help="continue an interrupted run from the first row that was not fully indexed")
+args = parser.parse_args()
+if args.resume and args.delete_missing:
+    parser.error("--delete-missing needs a complete pass over the CSV and cannot be combined with --resume")
 
 # Load environment variables from .env file
 load_dotenv(override=True)
 
 # Instantiate a Ducky AI Client
 # The API key is retrieved from the environment variables
-client = DuckyAI(api_key=os.getenv("DUCKY_API_KEY"))
+# DUCKY_SERVER_URL optionally points the client at a different server, e.g. a local stub of the API
+ducky_server_url = os.getenv("DUCKY_SERVER_URL")
+if ducky_server_url:
+    client = DuckyAI(api_key=os.getenv("DUCKY_API_KEY"), server_url=ducky_server_url)
+else:
+    client = DuckyAI(api_key=os.getenv("DUCKY_API_KEY"))
 
 # Get DUCKY_INDEX_NAME from environment variables
 ducky_index_name = os.getenv("DUCKY_INDEX_NAME")
@@ -23,16 +48,53 @@ if ducky_index_name is None:
 # Define the path to the CSV file
 csv_file_path = "data/hubspot_multi_with_activities.csv"
 
+# The manifest remembers the content hash of every document indexed so far
+# Scoped to the CSV, so --delete-missing leaves documents from other sources in the same index alone
+manifest = IndexManifest(os.getenv("DUCKY_MANIFEST_PATH", "data/index_manifest.db"), ducky_index_name, source=csv_file_path)
+
+# The progress log records, in order, every row whose documents DuckyAI has acknowledged
+progress = ProgressLog(f"{csv_file_path}.progress", csv_file_path, resume=args.resume)
+
+
+def on_indexed(doc):
+    manifest.record(doc["doc_id"], doc["doc_hash"])
+    progress.ack(doc["doc_id"])
+
+
+# Documents are sent in batches, with several batches in flight at once
+# Each document is recorded in the manifest and progress log once DuckyAI has accepted it
+# Documents that still fail after retries are reported and picked up by the next run without --resume
+indexer = BatchIndexer(
+    client,
+    ducky_index_name,
+    batch_size=int(os.getenv("DUCKY_BATCH_SIZE", "100")),
+    concurrency=int(os.getenv("DUCKY_INDEX_CONCURRENCY", "8")),
+    on_indexed=on_indexed,
+    on_failed=lambda doc: progress.ack(doc["doc_id"]),
+)
+skipped = 0
+
 # Read the CSV and index each activity as a document
-dedup_set = set()
-with open(csv_file_path, 'r', encoding='utf-8') as f:
-    reader = csv.DictReader(f)
-    for idx, row in enumerate(reader):
+# Activities already indexed by the interrupted run count as seen for deduplication
+dedup_set = set(progress.doc_ids)
+with open(csv_file_path, 'r', encoding='utf-8', newline='') as f:
+    # Read with readline() so f.tell() gives the position right after each record
+    lines = iter(f.readline, '')
+    reader = csv.DictReader(lines)
+    fieldnames = reader.fieldnames
+    if progress.offset is not None:
+        # Jump straight to the first row that was not fully indexed
+        f.seek(progress.offset)
+        reader = csv.DictReader(lines, fieldnames=fieldnames)
+    for idx, row in enumerate(reader, start=progress.row):
+        next_offset = f.tell()
         # Deduplicate by Activity ID
         activity_id = row.get("Activity ID")
-        if not activity_id or activity_id in dedup_set:
+        doc_id = stable_doc_id("hubspot-activity", activity_id)
+        if not activity_id or doc_id in dedup_set:
+            progress.add_row(idx, next_offset)
             continue
-        dedup_set.add(activity_id)
+        dedup_set.add(doc_id)
         # Compose content and metadata
         content = f"Deal: {row.get('Deal Name')} (ID: {row.get('Deal ID')})\n" \
                   f"Amount: {row.get('Amount')} | Stage: {row.get('Deal Stage')} | Pipeline: {row.get('Pipeline')} | Close Date: {row.get('Close Date')}\n" \
@@ -66,10 +128,33 @@ with open(csv_file_path, 'r', encoding='utf-8') as f:
             "activity_body": row.get("Activity Body"),
             "row_index": idx
         }
-        client.documents.index(
-            index_name=ducky_index_name,
-            content=content,
-            metadata=metadata,
-        )
+        # Skip activities whose indexed copy is already up to date
+        # row_index is left out of the hash because it shifts whenever earlier rows change
+        doc_hash = content_hash(content, {k: v for k, v in metadata.items() if k != "row_index"})
+        if manifest.is_unchanged(doc_id, doc_hash):
+            skipped += 1
+            progress.add_row(idx, next_offset)
+            continue
+        # Changed activities are re-indexed under the same doc_id
+        # The row is registered before sending so its acknowledgement can't be missed
+        progress.add_row(idx, next_offset, [doc_id])
+        indexer.add(content=content, metadata=metadata, doc_id=doc_id, doc_hash=doc_hash)
+
+# Send the last partial batch and wait for everything in flight
+indexer.close()
+progress.close()
+print(f"Skipped {skipped} unchanged activities")
+changed = indexer.indexed
+
+# Optionally remove activities that are no longer in the CSV
+if args.delete_missing:
+    deleted = delete_missing_documents(client, ducky_index_name, manifest)
+    print(f"Deleted {deleted} activities no longer present in {csv_file_path}")
+    changed += deleted
+manifest.close()
+
+# Tell running apps to stop serving retrieval results cached before this run
+if changed:
+    bump_index_version(os.getenv("DUCKY_INDEX_VERSION_FILE", "data/index_version.json"), ducky_index_name)
 
 print(f"Successfully indexed activities from {csv_file_path} to index {ducky_index_name}")
\ No newline at end of file
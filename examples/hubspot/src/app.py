@@ -1,82 +1,150 @@
 # ── imports you already have ────────────────────────────────────────────────
-import os, groq, requests
+import os, asyncio, json
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from fastapi import FastAPI
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from duckyai import DuckyAI
+from src.chat_service import ChatService
+from src.context_builder import load_encoding
+from src.http_transport import shared_transport_from_env
 
-# ── NEW: slack-bolt / threading imports ─────────────────────────────────────
-from slack_bolt import App as SlackApp
-from slack_bolt.adapter.socket_mode import SocketModeHandler
-import threading
+# ── NEW: slack-bolt imports (async adapter, runs on FastAPI's event loop) ───
+from slack_bolt.async_app import AsyncApp as SlackApp
+from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+from slack_sdk.web.async_client import AsyncWebClient
 
 # ── env-vars & clients (unchanged) ──────────────────────────────────────────
 load_dotenv(override=True)  # Load environment variables from .env file
-app       = FastAPI()
-client    = DuckyAI(api_key=os.getenv("DUCKY_API_KEY"))
-groq_cl   = groq.Client(api_key=os.getenv("GROQ_API_KEY"))
-index     = os.getenv("DUCKY_INDEX_NAME", "ducky-slack-test")
 
-print(f"DUCKY_INDEX_NAME: {index}")
+# bounds a whole /chat request or Slack mention (per-backend timeouts live in ChatService)
+CHAT_TIMEOUT_SECONDS  = float(os.getenv("CHAT_TIMEOUT_SECONDS", "45"))
+SLACK_TIMEOUT_SECONDS = float(os.getenv("SLACK_TIMEOUT_SECONDS", "30"))
+SLACK_BOT_TOKEN = os.getenv("SLACK_BOT_TOKEN")     # xoxb-…
+SLACK_APP_TOKEN = os.getenv("SLACK_APP_TOKEN")     # xapp-1-A… with connections:write
+
+@asynccontextmanager
+async def lifespan(app):
+    global chat
+    # the tokenizer may be downloaded on first load; do it now, off the event loop
+    await asyncio.to_thread(load_encoding)
+    # one pooled keep-alive transport for DuckyAI, Groq and Slack, opened here and closed on shutdown
+    transport = shared_transport_from_env()
+    # the chat pipeline, called directly by both /chat and the Slack mention handler
+    chat = ChatService(transport)
+    # Socket Mode connects from inside the server's event loop, next to the HTTP routes
+    socket_mode = None
+    if SLACK_BOT_TOKEN and SLACK_APP_TOKEN:
+        socket_mode = AsyncSocketModeHandler(bolt_app(transport), SLACK_APP_TOKEN)
+        await socket_mode.connect_async()
+    else:
+        print("SLACK_BOT_TOKEN / SLACK_APP_TOKEN not set: Slack bot disabled, serving the HTTP API only")
+    yield
+    if socket_mode is not None:
+        await socket_mode.close_async()
+    await chat.close()
+    await transport.aclose()
+
+app  = FastAPI(lifespan=lifespan)
+chat = None   # ChatService, created on startup
+
+print(f"DUCKY_INDEX_NAME: {os.getenv('DUCKY_INDEX_NAME', 'ducky-slack-test')}")
 
 # ── CORS ───────────────────────────────────
 app.add_middleware(
     CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]
 )
 
-# ── FastAPI /chat endpoint (unchanged) ──────────────────────────────────────
+# ── FastAPI /chat endpoint ──────────────────────────────────────────────
 class ChatMessage(BaseModel):
     message: str
 
+class ClientDisconnected(Exception):
+    """The caller went away before the reply was ready."""
+
+async def run_cancellable(request, coro, timeout):
+    """Await `coro`; give up (cancelling in-flight calls) on timeout or client disconnect."""
+    task = asyncio.ensure_future(asyncio.wait_for(coro, timeout))
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=0.5)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise ClientDisconnected()
+    finally:
+        task.cancel()
+
+def sse(data, event=None):
+    """Format one Server-Sent Event."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return JSONResponse(chat.cache_stats())
+
 @app.post("/chat")
-async def chat(msg: ChatMessage):
-    docs = client.documents.retrieve(index_name=index, query=msg.message, top_k=20)
-    if docs.documents:
-        ctx = " ".join(docs.documents[0].content_chunks or [])
-        completion = groq_cl.chat.completions.create(
-            model=os.getenv("GROQ_MODEL_NAME", "llama3-70b-8192"),
-            messages=[
-                {"role": "system",
-                 "content": f"You are a Slack assistant. Consider the entire conversation history from this Slack channel to provide a relevant and helpful answer. Conversation history: {ctx}"},
-                {"role": "user", "content": msg.message}
-            ]
-        )
-        reply = completion.choices[0].message.content
-    else:
-        reply = "Sorry, I don't know how to respond yet."
+async def chat_endpoint(msg: ChatMessage, request: Request):
+    try:
+        reply = await run_cancellable(request, chat.answer(msg.message), CHAT_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        return JSONResponse({"response": "Sorry, that took too long. Please try again."}, status_code=504)
+    except ClientDisconnected:
+        return Response(status_code=499)   # client closed request
 
     return JSONResponse({"response": reply})
 
-# ────────────────────────────────────────────────────────────────────────────
-#                Slack Bolt Socket-Mode section (new)
-# ────────────────────────────────────────────────────────────────────────────
-SLACK_BOT_TOKEN = os.getenv("SLACK_BOT_TOKEN")     # xoxb-…
-SLACK_APP_TOKEN = os.getenv("SLACK_APP_TOKEN")     # xapp-1-A… with connections:write
+# ── FastAPI /chat/stream endpoint (Server-Sent Events) ─────────────────────
+# events: {"token": "..."} per chunk, then "done" (or "error"); Starlette cancels
+# the generator when the client disconnects, which also closes the Groq stream
+@app.post("/chat/stream")
+async def chat_stream(msg: ChatMessage):
+    async def events():
+        try:
+            async for token in chat.stream_answer(msg.message, CHAT_TIMEOUT_SECONDS):
+                yield sse({"token": token})
+        except asyncio.TimeoutError:
+            yield sse({"error": "Sorry, that took too long. Please try again."}, event="error")
+            return
+        except Exception as exc:
+            yield sse({"error": str(exc)}, event="error")
+            return
+        yield sse({}, event="done")
 
-bolt = SlackApp(token=SLACK_BOT_TOKEN)
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},   # no proxy buffering
+    )
 
-@bolt.event("app_mention")
-def handle_mention(body, say):
+# ────────────────────────────────────────────────────────────────────────────
+#                Slack Bolt Socket-Mode section
+# ────────────────────────────────────────────────────────────────────────────
+async def handle_mention(body, say):
     event       = body["event"]
-    user_text   = event["text"].split(maxsplit=1)[1]   # drop "@bot"
+    parts       = event["text"].split(maxsplit=1)   # drop "@bot"
+    user_text   = parts[1] if len(parts) > 1 else ""
     thread_ts   = event.get("thread_ts") or event["ts"]
 
-    # call our own FastAPI /chat endpoint
+    # answer in-process: same pipeline as /chat, no HTTP round trip to ourselves
     try:
-        resp = requests.post(
-            "http://localhost:8000/chat",              # <── Updated to internal container port
-            json={"message": user_text}, timeout=15
-        ).json()
-        answer = resp.get("response", "…")
+        answer = await asyncio.wait_for(chat.answer(user_text), CHAT_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        answer = "Sorry, that took too long. Please try again."
     except Exception as exc:
-        answer = f"Error calling backend: {exc}"
-
-    say(text=answer, thread_ts=thread_ts)
+        answer = f"Error answering: {exc}"
 
-# ── run Bolt in a background thread so FastAPI keeps serving ────────────────
-def start_bolt():
-    SocketModeHandler(bolt, SLACK_APP_TOKEN).start()
+    await say(text=answer, thread_ts=thread_ts)
 
-threading.Thread(target=start_bolt, daemon=True).start()
\ No newline at end of file
+def bolt_app(transport):
+    """The Bolt app; its Web API calls (e.g. say()) reuse one keep-alive session instead of one per call."""
+    web_client = AsyncWebClient(
+        token=SLACK_BOT_TOKEN,
+        timeout=int(SLACK_TIMEOUT_SECONDS),
+        session=transport.aiohttp_session(SLACK_TIMEOUT_SECONDS),
+    )
+    bolt = SlackApp(client=web_client)
+    bolt.event("app_mention")(handle_mention)
+    return bolt
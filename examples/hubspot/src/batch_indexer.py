@@ -0,0 +1,163 @@
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BatchEndpointUnavailable(Exception):
+    """The SDK or server does not support batch indexing."""
+
+
+# Largest batch the batch-index endpoint accepts
+MAX_BATCH_SIZE = 100
+
+# Errors that come from our own code (e.g. calling the SDK with the wrong arguments); retrying cannot help
+PROGRAMMING_ERRORS = (TypeError, AttributeError, NameError, NotImplementedError, AssertionError)
+
+
+def is_bug(error):
+    return isinstance(error, PROGRAMMING_ERRORS)
+
+
+def is_retryable(error):
+    """
+    API errors are retried unless their status is a client error other than
+    408/429. Errors without a status (httpx.TransportError, timeouts, dropped
+    connections) are transient too; only programming errors fail fast.
+    """
+    if is_bug(error):
+        return False
+    status = getattr(error, "status_code", None)
+    return status is None or status in (408, 429) or not 400 <= status < 500
+
+
+class BatchIndexer:
+    """
+    Buffers documents and sends them to DuckyAI in batches of `batch_size`
+    (at most MAX_BATCH_SIZE).
+
+    Batches go to the batch-index endpoint when the SDK/server supports it and
+    fall back to indexing each document individually otherwise. Up to
+    `concurrency` batches are in flight at once. Network errors, timeouts, rate
+    limits and server errors are retried with jittered exponential backoff;
+    other 4xx responses are not, and programming errors are raised immediately. `on_indexed(doc)` is called on the
+    caller's thread, in submission order, for every document that made it in,
+    and `on_failed(doc)` for every document that was given up on.
+    """
+
+    def __init__(self, client, index_name, batch_size=100, concurrency=8, max_retries=5,
+                 on_indexed=None, on_failed=None):
+        self.client = client
+        self.index_name = index_name
+        self.batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.on_indexed = on_indexed
+        self.on_failed = on_failed
+        self.use_batch_endpoint = hasattr(client.documents, "batch_index")
+        self.indexed = 0
+        self.failed = []
+        self._buffer = []
+        self._pending = deque()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._started = time.monotonic()
+        self._last_report = self._started
+
+    def add(self, content, metadata=None, doc_id=None, **extra):
+        """Queue one document; extra keys are passed through to the callback."""
+        doc = {"content": content, "metadata": metadata or {}, **extra}
+        if doc_id is not None:
+            doc["doc_id"] = doc_id
+        self._buffer.append(doc)
+        if len(self._buffer) >= self.batch_size:
+            self._submit()
+
+    def close(self):
+        """Send everything still buffered, wait for it and print a summary."""
+        if self._buffer:
+            self._submit()
+        while self._pending:
+            self._collect(self._pending.popleft())
+        self._executor.shutdown()
+        elapsed = time.monotonic() - self._started
+        rate = self.indexed / elapsed if elapsed else 0.0
+        print(f"Indexed {self.indexed} documents in {elapsed:.1f}s ({rate:.1f} docs/sec), {len(self.failed)} failed")
+        for doc, error in self.failed:
+            print(f"- failed {doc.get('doc_id') or doc['content'][:60]!r}: {error}")
+
+    def _submit(self):
+        batch, self._buffer = self._buffer, []
+        self._pending.append(self._executor.submit(self._send_batch, batch))
+        # Keep a bounded number of batches in flight; collect in order so callbacks stay ordered
+        while len(self._pending) >= self.concurrency:
+            self._collect(self._pending.popleft())
+
+    def _collect(self, future):
+        indexed, failed = future.result()
+        self.indexed += len(indexed)
+        self.failed.extend(failed)
+        if self.on_indexed:
+            for doc in indexed:
+                self.on_indexed(doc)
+        if self.on_failed:
+            for doc, _ in failed:
+                self.on_failed(doc)
+        now = time.monotonic()
+        if now - self._last_report >= 10:
+            rate = self.indexed / (now - self._started)
+            print(f"Indexed {self.indexed} documents so far ({rate:.1f} docs/sec)")
+            self._last_report = now
+
+    def _send_batch(self, batch):
+        if self.use_batch_endpoint:
+            try:
+                self._with_retry(self._batch_index, batch)
+                return batch, []
+            except BatchEndpointUnavailable:
+                print("Batch-index endpoint unavailable; falling back to per-document indexing")
+                self.use_batch_endpoint = False
+            except Exception as e:
+                if is_bug(e):
+                    raise
+                print(f"Batch of {len(batch)} failed ({e}); retrying documents individually")
+        indexed, failed = [], []
+        for doc in batch:
+            try:
+                self._with_retry(self._index_one, doc)
+                indexed.append(doc)
+            except Exception as e:
+                if is_bug(e):
+                    raise
+                failed.append((doc, e))
+        return indexed, failed
+
+    def _batch_index(self, batch):
+        # index_name is a field of every document, not an argument of batch_index()
+        documents = [
+            {"index_name": self.index_name, **{k: v for k, v in doc.items() if k in ("content", "metadata", "doc_id")}}
+            for doc in batch
+        ]
+        try:
+            self.client.documents.batch_index(documents=documents)
+        except Exception as e:
+            if getattr(e, "status_code", None) in (404, 405):
+                raise BatchEndpointUnavailable() from e
+            raise
+
+    def _index_one(self, doc):
+        kwargs = {"index_name": self.index_name, "content": doc["content"], "metadata": doc["metadata"]}
+        if "doc_id" in doc:
+            kwargs["doc_id"] = doc["doc_id"]
+        self.client.documents.index(**kwargs)
+
+    def _with_retry(self, fn, *args):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return fn(*args)
+            except BatchEndpointUnavailable:
+                raise
+            except Exception as e:
+                if not is_retryable(e) or attempt == self.max_retries:
+                    raise
+                # Full jitter keeps concurrent workers from retrying in lockstep
+                time.sleep(random.uniform(0, min(30, 0.5 * 2 ** attempt)))
@@ -0,0 +1,107 @@
+import hashlib
+import re
+
+_UNLOADED = object()
+_encoding = _UNLOADED
+
+# Without tiktoken, count every run of up to 4 word characters and every punctuation mark as a token.
+# BPE tokenizers average about 4 characters per token on English text, so this lands close to the real count.
+APPROX_TOKEN_PATTERN = re.compile(r"\w{1,4}|[^\w\s]")
+WORD_PATTERN = re.compile(r"\w+")
+SEPARATOR = "\n\n"
+# Word n-grams compared to spot chunks that repeat each other (e.g. the overlap between neighbouring chunks)
+SHINGLE_SIZE = 5
+# A chunk sharing more than this fraction of its shingles with an already chosen chunk is dropped
+DUPLICATE_OVERLAP = 0.8
+
+
+def load_encoding():
+    """
+    Optional exact BPE counts with tiktoken, loaded on first use. tiktoken
+    downloads the encoding the first time; when it is missing or that fails
+    (offline, locked-down container) the regex estimate is used instead.
+    The download is blocking, so servers call this once at startup in a
+    worker thread rather than on the event loop during the first request.
+    """
+    global _encoding
+    if _encoding is _UNLOADED:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            if not isinstance(e, ImportError):
+                print(f"tiktoken encoding unavailable ({e}); estimating token counts")
+            _encoding = None
+    return _encoding
+
+
+def count_tokens(text):
+    """Token count of `text`: exact with tiktoken, otherwise a fast regex estimate."""
+    encoding = load_encoding()
+    if encoding is not None:
+        return len(encoding.encode_ordinary(text))
+    return len(APPROX_TOKEN_PATTERN.findall(text))
+
+
+def _shingles(words):
+    if len(words) <= SHINGLE_SIZE:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def rank_chunks(results, query):
+    """
+    Return every chunk of every retrieved document, most relevant first.
+
+    A chunk scores its document's relevance (DuckyAI's score when the response
+    has one, otherwise its rank) plus the fraction of the query's words it
+    contains, so the best passages of lower-ranked documents can still beat
+    the filler of the top one. Ties keep DuckyAI's order.
+    """
+    documents = results.documents or []
+    scores = getattr(results, "scores", None) or {}
+    top_score = max(scores.values(), default=0) or 1
+    query_words = set(WORD_PATTERN.findall(query.casefold()))
+    ranked = []
+    for rank, document in enumerate(documents):
+        score = scores.get(document.doc_id) if getattr(document, "doc_id", None) else None
+        document_relevance = score / top_score if score is not None else 1 - rank / len(documents)
+        for position, chunk in enumerate(document.content_chunks or []):
+            words = set(WORD_PATTERN.findall(chunk.casefold()))
+            overlap = len(query_words & words) / len(query_words) if query_words else 0.0
+            ranked.append((-(document_relevance + overlap), rank, position, chunk))
+    ranked.sort(key=lambda item: item[:3])
+    return [chunk for *_, chunk in ranked]
+
+
+def build_context(results, query, token_budget):
+    """
+    Pack the most relevant retrieved chunks into at most `token_budget` tokens.
+
+    Chunks are taken in rank_chunks() order. Exact repeats and chunks that
+    mostly overlap one already chosen are skipped. A chunk too large for the
+    space left is skipped too, so smaller ones further down can still fill it.
+    """
+    chosen = []
+    chosen_shingles = []
+    seen = set()
+    used = 0
+    for chunk in rank_chunks(results, query):
+        text = chunk.strip()
+        words = WORD_PATTERN.findall(text.casefold())
+        if not words:
+            continue
+        digest = hashlib.sha1(" ".join(words).encode("utf-8")).digest()
+        if digest in seen:
+            continue
+        shingles = _shingles(words)
+        if any(len(shingles & other) > DUPLICATE_OVERLAP * len(shingles) for other in chosen_shingles):
+            continue
+        cost = count_tokens(text) + (count_tokens(SEPARATOR) if chosen else 0)
+        if used + cost > token_budget:
+            continue
+        seen.add(digest)
+        chosen_shingles.append(shingles)
+        chosen.append(text)
+        used += cost
+    return SEPARATOR.join(chosen)
@@ -0,0 +1,151 @@
+import json
+import sqlite3
+import threading
+import time
+from hubspot_api import chunked, to_entity, to_epoch_ms
+
+
+class EntityCache:
+    """
+    Persistent, size-bounded cache of HubSpot objects (contacts, companies) keyed
+    by object ID, shared by every worker thread.
+
+    - Entries older than `ttl_seconds` are treated as misses.
+    - Once more than `max_entries` are stored, the least recently used are evicted.
+    - validate() searches for objects modified since the last validation and
+      drops any cached copy whose last-modified time is older.
+    """
+
+    def __init__(self, path, object_type, last_modified_property, ttl_seconds, max_entries):
+        self.object_type = object_type
+        self.last_modified_property = last_modified_property
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS entities ("
+                " object_type TEXT NOT NULL,"
+                " object_id TEXT NOT NULL,"
+                " properties TEXT NOT NULL,"
+                " last_modified_ms INTEGER,"
+                " fetched_at REAL NOT NULL,"
+                " last_access REAL NOT NULL,"
+                " PRIMARY KEY (object_type, object_id))"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS entities_lru ON entities (object_type, last_access)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS validated ("
+                " object_type TEXT PRIMARY KEY,"
+                " through_ms INTEGER NOT NULL)"
+            )
+            self.conn.execute(
+                "DELETE FROM entities WHERE object_type = ? AND fetched_at < ?",
+                (object_type, time.time() - ttl_seconds),
+            )
+
+    def get_many(self, ids):
+        """Return {id: entity} for the cached, unexpired subset of `ids`."""
+        ids = list(dict.fromkeys(ids))
+        found = {}
+        now = time.time()
+        with self._lock:
+            for batch in chunked(ids, 500):
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT object_id, properties FROM entities WHERE object_type = ? AND fetched_at >= ?"
+                    f" AND object_id IN ({placeholders})",
+                    [self.object_type, now - self.ttl_seconds, *batch],
+                ).fetchall()
+                for object_id, properties in rows:
+                    found[object_id] = to_entity({"id": object_id, "properties": json.loads(properties)})
+            if found:
+                with self.conn:
+                    self.conn.executemany(
+                        "UPDATE entities SET last_access = ? WHERE object_type = ? AND object_id = ?",
+                        [(now, self.object_type, object_id) for object_id in found],
+                    )
+            self.hits += len(found)
+            self.misses += len(ids) - len(found)
+        return found
+
+    def put_many(self, entities):
+        """Store freshly fetched entities ({id: entity}), evicting LRU entries past the size bound."""
+        if not entities:
+            return
+        now = time.time()
+        rows = []
+        for object_id, entity in entities.items():
+            properties = dict(entity.properties or {})
+            last_modified = to_epoch_ms(properties.get(self.last_modified_property))
+            rows.append((self.object_type, str(object_id), json.dumps(properties, default=str), last_modified, now, now))
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO entities"
+                " (object_type, object_id, properties, last_modified_ms, fetched_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            count = self.conn.execute(
+                "SELECT COUNT(*) FROM entities WHERE object_type = ?", (self.object_type,)
+            ).fetchone()[0]
+            if count > self.max_entries:
+                self.conn.execute(
+                    "DELETE FROM entities WHERE object_type = ? AND object_id IN ("
+                    " SELECT object_id FROM entities WHERE object_type = ? ORDER BY last_access LIMIT ?)",
+                    (self.object_type, self.object_type, count - self.max_entries),
+                )
+
+    def validate(self, api, validated_through_ms):
+        """
+        Evict cached objects that HubSpot reports as modified after they were
+        cached, then record `validated_through_ms` as the new watermark.
+        """
+        row = self.conn.execute(
+            "SELECT through_ms FROM validated WHERE object_type = ?", (self.object_type,)
+        ).fetchone()
+        stale = 0
+        if row:
+            changed = {
+                entity.id: to_epoch_ms(entity.properties.get(self.last_modified_property))
+                for entity in api.search_modified_since(self.object_type, self.last_modified_property, row[0])
+            }
+            with self._lock, self.conn:
+                for batch in chunked(list(changed), 500):
+                    placeholders = ",".join("?" * len(batch))
+                    cached = self.conn.execute(
+                        f"SELECT object_id, last_modified_ms FROM entities WHERE object_type = ?"
+                        f" AND object_id IN ({placeholders})",
+                        [self.object_type, *batch],
+                    ).fetchall()
+                    stale_ids = [
+                        (self.object_type, object_id) for object_id, cached_ms in cached
+                        if cached_ms is None or changed[object_id] is None or changed[object_id] > cached_ms
+                    ]
+                    self.conn.executemany(
+                        "DELETE FROM entities WHERE object_type = ? AND object_id = ?", stale_ids
+                    )
+                    stale += len(stale_ids)
+        else:
+            # No watermark means we cannot tell what changed since these entries were stored
+            with self._lock, self.conn:
+                self.conn.execute("DELETE FROM entities WHERE object_type = ?", (self.object_type,))
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO validated (object_type, through_ms) VALUES (?, ?)",
+                (self.object_type, validated_through_ms),
+            )
+        return stale
+
+    def stats(self):
+        total = self.hits + self.misses
+        hit_rate = (self.hits / total * 100) if total else 0.0
+        return f"{self.object_type} cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate)"
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,90 @@
+import csv
+import os
+import time
+
+FLUSH_EVERY_ROWS = 500
+CHECKPOINT_INTERVAL_S = 5
+
+
+class StreamingCsvWriter:
+    """
+    Streams rows to `<path>.partial` as they are produced and atomically renames
+    it over `path` once the export completes. A resume marker (the last fully
+    written deal and the byte offset after its rows) is saved in SyncState, so an
+    interrupted export can truncate back to that point and carry on.
+
+    On resume, the deals already in the truncated file are collected in
+    `written_deal_ids`, so the caller can skip them no matter in which order
+    HubSpot lists deals. Deals without any rows are not in the file and are
+    simply fetched again.
+    """
+
+    def __init__(self, path, fieldnames, state, started_ms, resumable=False):
+        self.path = path
+        self.partial_path = f"{path}.partial"
+        self.state = state
+        self.started_ms = started_ms
+        self.resumable = resumable
+        self.rows_written = 0
+        self.resume_after = None
+        self.written_deal_ids = set()
+        self._last_deal_id = None
+        self._last_checkpoint = time.monotonic()
+
+        progress = state.get_export_progress(path) if resumable else None
+        if progress and os.path.exists(self.partial_path):
+            # Keep the original start time: rows written before the interruption are only that fresh
+            self.resume_after, offset, self.started_ms = progress
+            # Drop anything written after the last durable marker
+            with open(self.partial_path, 'r+b') as f:
+                f.truncate(offset)
+            with open(self.partial_path, 'r', newline='', encoding='utf-8') as f:
+                self.written_deal_ids = {row['Deal ID'] for row in csv.DictReader(f)}
+            self.file = open(self.partial_path, 'a', newline='', encoding='utf-8')
+            self.writer = csv.DictWriter(self.file, fieldnames=fieldnames)
+            self._last_deal_id = self.resume_after
+            print(f"Resuming export after deal {self.resume_after} ({len(self.written_deal_ids)} deals already written)")
+        else:
+            state.clear_export_progress(path)
+            self.file = open(self.partial_path, 'w', newline='', encoding='utf-8')
+            self.writer = csv.DictWriter(self.file, fieldnames=fieldnames)
+            self.writer.writeheader()
+
+    def write_deal_rows(self, last_deal_id, rows):
+        """Write every row for one deal (or one page of deals) and record progress."""
+        for row in rows:
+            self.writer.writerow(row)
+            self.rows_written += 1
+            if self.rows_written % FLUSH_EVERY_ROWS == 0:
+                self.file.flush()
+        self._last_deal_id = last_deal_id
+        if time.monotonic() - self._last_checkpoint >= CHECKPOINT_INTERVAL_S:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Make everything written so far durable, then save the resume marker."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        if self.resumable and self._last_deal_id is not None:
+            offset = os.fstat(self.file.fileno()).st_size
+            self.state.set_export_progress(self.path, self._last_deal_id, offset, self.started_ms)
+        self._last_checkpoint = time.monotonic()
+
+    def commit(self):
+        """Finish the export: replace `path` with the completed file."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.partial_path, self.path)
+        self.state.clear_export_progress(self.path)
+
+    def abort(self):
+        """Stop without publishing, keeping the partial file and marker for a later resume."""
+        self.checkpoint()
+        self.file.close()
+
+    def discard(self):
+        """Stop and throw away the partial file."""
+        self.file.close()
+        os.remove(self.partial_path)
+        self.state.clear_export_progress(self.path)
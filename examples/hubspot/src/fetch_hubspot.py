@@ -2,13 +2,55 @@ import os
 import csv
 from datetime import datetime
 import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from dotenv import load_dotenv
 from hubspot import HubSpot
 from hubspot.crm.deals import ApiException
+from hubspot_api import HubSpotBatchClient, HubSpotHTTPError, call_with_retry, chunked, rate_limiter_per_10s
+from sync_state import SyncState
+from export_writer import StreamingCsvWriter
+from entity_cache import EntityCache
 
 load_dotenv(override=True)  # take environment variables from .env and override existing ones.
 
 HUBSPOT_TOKEN = os.getenv("HUBSPOT_API_TOKEN")
+# "batch" resolves associations/objects 100 IDs at a time; "sequential" is the original one-call-per-object mode
+FETCH_MODE = os.getenv("HUBSPOT_FETCH_MODE", "batch")
+# Override to point the batch mode at a local fake HubSpot server
+HUBSPOT_API_BASE = os.getenv("HUBSPOT_API_BASE", "https://api.hubapi.com")
+# Number of deals (sequential mode) or deal pages (batch mode) processed in parallel
+HUBSPOT_CONCURRENCY = int(os.getenv("HUBSPOT_CONCURRENCY", "4"))
+# Shared request budget per rolling 10 seconds: 100 for most private apps, 190 on Pro/Enterprise
+HUBSPOT_REQUESTS_PER_10S = int(os.getenv("HUBSPOT_REQUESTS_PER_10S", "100"))
+# "full" re-exports the whole portal; "incremental" only re-fetches deals touched since the last checkpoint
+SYNC_MODE = os.getenv("HUBSPOT_SYNC_MODE", "full")
+HUBSPOT_STATE_FILE = os.getenv("HUBSPOT_STATE_FILE", "hubspot_sync_state.db")
+# Persistent contact/company cache shared across runs
+HUBSPOT_CACHE_FILE = os.getenv("HUBSPOT_CACHE_FILE", "hubspot_entity_cache.db")
+HUBSPOT_CACHE_TTL_HOURS = float(os.getenv("HUBSPOT_CACHE_TTL_HOURS", "168"))
+HUBSPOT_CACHE_MAX_ENTRIES = int(os.getenv("HUBSPOT_CACHE_MAX_ENTRIES", "200000"))
+# Re-read a few minutes before the last run started to cover HubSpot's search indexing lag
+CHECKPOINT_OVERLAP_MS = 5 * 60 * 1000
+
+OUTPUT_FILENAME = 'hubspot_multi_with_activities.csv'
+CSV_HEADERS = [
+    'Deal ID', 'Deal Name', 'Amount', 'Deal Stage', 'Pipeline', 'Close Date',
+    'Contact ID', 'First Name', 'Last Name', 'Email', 'Phone Number', 'Lifecycle Stage',
+    'Company ID', 'Company Name', 'Company Domain', 'Company Industry', 'Company Annual Revenue',
+    'Activity ID', 'Activity Type', 'Activity Date', 'Activity Subject', 'Activity Body'
+]
+SYNC_OBJECT_TYPES = ['deals', 'companies', 'contacts', 'notes', 'calls', 'meetings']
+# Contacts expose their modification time as lastmodifieddate; every other object uses hs_lastmodifieddate
+LAST_MODIFIED_PROPERTY = {'contacts': 'lastmodifieddate'}
+
+DEAL_PROPERTIES = ["dealname", "amount", "dealstage", "pipeline", "closedate"]
+# The last-modified properties are not exported; the entity cache uses them to detect stale entries
+CONTACT_PROPERTIES = ["firstname", "lastname", "email", "phone", "lifecyclestage", "lastmodifieddate"]
+COMPANY_PROPERTIES = ["name", "domain", "industry", "annualrevenue", "hs_lastmodifieddate"]
+ACTIVITY_TYPES = ['note', 'call', 'meeting']
 
 def handle_api_exception(e):
     """Prints a helpful message for HubSpot API exceptions."""
@@ -36,6 +78,10 @@ def handle_api_exception(e):
                 return
         except (json.JSONDecodeError, KeyError):
             pass  # Fall through to the generic error message
+    if e.status == 429:
+        print("\nError: HubSpot rate limit still exceeded after retrying; the data for this call was skipped.")
+        print("Lower HUBSPOT_CONCURRENCY or HUBSPOT_REQUESTS_PER_10S and re-run.")
+        return
     print(f"An HubSpot API error occurred: {e}")
 
 def get_property_value(entity, property_name, default=''):
@@ -60,16 +106,38 @@ def format_date(timestamp_str, fmt='%m/%d/%Y'):
     except (ValueError, TypeError):
         return timestamp_str
 
-def get_all_deals(client):
+class ExportAborted(Exception):
+    """Raised when the deal listing itself fails and the export cannot continue."""
+
+def deal_sort_key(deal_id):
+    """Numeric order for deal ID strings."""
+    return (len(deal_id), deal_id)
+
+def ordered_map(executor, fn, items, max_in_flight):
+    """
+    Like executor.map, but consumes `items` lazily and keeps at most
+    `max_in_flight` tasks queued. Results are yielded in input order so the
+    CSV comes out identical regardless of which worker finishes first.
+    """
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def get_all_deals(client, call=call_with_retry):
     """Fetch all deals with pagination."""
     all_deals = []
     after = None
     while True:
         try:
-            deals_page = client.crm.deals.basic_api.get_page(
+            deals_page = call(
+                client.crm.deals.basic_api.get_page,
                 limit=100,
                 after=after,
-                properties=["dealname", "amount", "dealstage", "pipeline", "closedate"]
+                properties=DEAL_PROPERTIES
             )
             all_deals.extend(deals_page.results)
             if deals_page.paging and deals_page.paging.next:
@@ -81,125 +149,386 @@ def get_all_deals(client):
             return None
     return all_deals
 
-def main():
+def activity_properties(activity_type):
+    """Properties to request for a note, call or meeting."""
+    props = ["hs_timestamp", f"hs_{activity_type}_body"]
+    if activity_type == 'call':
+        props.append('hs_call_title')
+    elif activity_type == 'meeting':
+        props.append('hs_meeting_title')
+    return props
+
+def build_row(deal, company_details, activity_type, activity_id, activity_details, activity_contact_id, contact_details):
+    """Flatten one deal/company/contact/activity combination into a CSV row."""
+    deal_name = get_property_value(deal, 'dealname')
+    return {
+        'Deal ID': deal.id,
+        'Deal Name': deal_name,
+        'Amount': get_property_value(deal, 'amount'),
+        'Deal Stage': get_property_value(deal, 'dealstage'),
+        'Pipeline': get_property_value(deal, 'pipeline'),
+        'Close Date': format_date(get_property_value(deal, 'closedate')),
+        'Contact ID': activity_contact_id,
+        'First Name': get_property_value(contact_details, 'firstname'),
+        'Last Name': get_property_value(contact_details, 'lastname'),
+        'Email': get_property_value(contact_details, 'email'),
+        'Phone Number': get_property_value(contact_details, 'phone'),
+        'Lifecycle Stage': get_property_value(contact_details, 'lifecyclestage'),
+        'Company ID': get_property_value(company_details, 'hs_object_id'),
+        'Company Name': get_property_value(company_details, 'name'),
+        'Company Domain': get_property_value(company_details, 'domain'),
+        'Company Industry': get_property_value(company_details, 'industry'),
+        'Company Annual Revenue': get_property_value(company_details, 'annualrevenue'),
+        'Activity ID': activity_id,
+        'Activity Type': activity_type.capitalize(),
+        'Activity Date': format_date(get_property_value(activity_details, 'hs_timestamp'), '%m/%d/%Y %H:%M'),
+        'Activity Subject': get_property_value(activity_details, 'hs_call_title') or get_property_value(activity_details, 'hs_meeting_title') or f"{activity_type.capitalize()} about {deal_name}",
+        'Activity Body': get_property_value(activity_details, f"hs_{activity_type}_body")
+    }
+
+def process_deal(client, call, deal, contacts_cache, companies_cache, failures):
     """
-    Fetches deals, contacts, companies, and activities from HubSpot
-    and writes them to a CSV file named hubspot_multi_with_activities.csv.
+    Sequential mode: fetch everything for one deal with one SDK call per object.
+    Calls that fail are logged and appended to `failures`; the deal's rows are returned without that data.
     """
-    if not HUBSPOT_TOKEN:
-        print("HUBSPOT_API_TOKEN not found. Please set it in your .env file.")
-        return
+    rows = []
+    deal_name = get_property_value(deal, 'dealname')
+    print(f"Processing Deal: {deal_name}")
 
-    client = HubSpot(access_token=HUBSPOT_TOKEN)
+    company_details = None
+    try:
+        company_associations = call(client.crm.deals.associations_api.get_all, deal.id, 'company')
+        if company_associations.results:
+            company_id = company_associations.results[0].id
+            company_details = companies_cache.get_many([company_id]).get(company_id)
+            if company_details is None:
+                company_details = call(
+                    client.crm.companies.basic_api.get_by_id, company_id, properties=COMPANY_PROPERTIES
+                )
+                companies_cache.put_many({company_id: company_details})
+    except ApiException as e:
+        print(f"Error fetching company for deal {deal.id}:")
+        handle_api_exception(e)
+        failures.append(("companies", deal.id))
 
-    contacts_cache = {}
-    companies_cache = {}
-    output_data = []
-    csv_headers = [
-        'Deal ID', 'Deal Name', 'Amount', 'Deal Stage', 'Pipeline', 'Close Date',
-        'Contact ID', 'First Name', 'Last Name', 'Email', 'Phone Number', 'Lifecycle Stage',
-        'Company ID', 'Company Name', 'Company Domain', 'Company Industry', 'Company Annual Revenue',
-        'Activity ID', 'Activity Type', 'Activity Date', 'Activity Subject', 'Activity Body'
-    ]
+    try:
+        contact_associations = call(client.crm.deals.associations_api.get_all, deal.id, 'contact')
+        for assoc in contact_associations.results:
+            contact_id = assoc.id
+            if not contacts_cache.get_many([contact_id]):
+                contacts_cache.put_many({contact_id: call(
+                    client.crm.contacts.basic_api.get_by_id, contact_id, properties=CONTACT_PROPERTIES
+                )})
+    except ApiException as e:
+        print(f"Error fetching contacts for deal {deal.id}:")
+        handle_api_exception(e)
+        failures.append(("contacts", deal.id))
 
-    deals = get_all_deals(client)
-    if deals is None:
-        return
-        
-    print(f"Found {len(deals)} deals. Processing...")
+    for activity_type in ACTIVITY_TYPES:
+        try:
+            activity_associations = call(client.crm.deals.associations_api.get_all, deal.id, activity_type)
+            for activity_assoc in activity_associations.results:
+                activity_id = activity_assoc.id
 
-    for deal in deals:
-        deal_name = get_property_value(deal, 'dealname')
-        print(f"Processing Deal: {deal_name}")
+                activity_api = getattr(client.crm.objects, f"{activity_type}s")
+                activity_details = call(activity_api.basic_api.get_by_id, activity_id, properties=activity_properties(activity_type))
 
-        company_details = None
-        try:
-            company_associations = client.crm.deals.associations_api.get_all(deal.id, 'company')
-            if company_associations.results:
-                company_id = company_associations.results[0].id
-                if company_id not in companies_cache:
-                    companies_cache[company_id] = client.crm.companies.basic_api.get_by_id(
-                        company_id, properties=["name", "domain", "industry", "annualrevenue"]
-                    )
-                company_details = companies_cache[company_id]
+                activity_contact_id = None
+                contact_details = None
+                activity_contact_assocs = call(activity_api.associations_api.get_all, activity_id, 'contact')
+                if activity_contact_assocs.results:
+                    activity_contact_id = activity_contact_assocs.results[0].id
+                    contact_details = contacts_cache.get_many([activity_contact_id]).get(activity_contact_id)
+
+                rows.append(build_row(
+                    deal, company_details, activity_type, activity_id,
+                    activity_details, activity_contact_id, contact_details
+                ))
         except ApiException as e:
-            print(f"Error fetching company for deal {deal.id}:")
+            print(f"Error fetching {activity_type}s for deal {deal.id}:")
             handle_api_exception(e)
+            failures.append((f"{activity_type}s", deal.id))
+
+    return rows
+
+def fetch_sequential(client, contacts_cache, companies_cache, limiter, failures, skip_deal_ids=frozenset()):
+    """
+    Original per-deal mode: one SDK call per association and per activity,
+    deals processed in parallel. Yields (deal_id, rows) in deal order,
+    leaving out the deals in `skip_deal_ids` (already written by an interrupted run).
+    """
+    call = partial(call_with_retry, limiter=limiter)
+
+    deals = get_all_deals(client, call)
+    if deals is None:
+        raise ExportAborted()
+    deals = [deal for deal in deals if deal.id not in skip_deal_ids]
+
+    print(f"Found {len(deals)} deals. Processing with {HUBSPOT_CONCURRENCY} workers...")
+
+    def worker(deal):
+        return deal.id, process_deal(client, call, deal, contacts_cache, companies_cache, failures)
 
+    with ThreadPoolExecutor(max_workers=HUBSPOT_CONCURRENCY) as executor:
+        yield from ordered_map(executor, worker, deals, HUBSPOT_CONCURRENCY * 2)
+
+def fetch_deal_batch(api, deals, contacts_cache, companies_cache, failures):
+    """
+    Resolve associations and objects for a page of deals with batch endpoints
+    and return the CSV rows for those deals, in deal order. Batch requests that
+    fail are logged and appended to `failures`; the rows are built without that data.
+    """
+    deal_ids = [deal.id for deal in deals]
+
+    def safe(what, fn, *args):
         try:
-            contact_associations = client.crm.deals.associations_api.get_all(deal.id, 'contact')
-            for assoc in contact_associations.results:
-                contact_id = assoc.id
-                if contact_id not in contacts_cache:
-                    contacts_cache[contact_id] = client.crm.contacts.basic_api.get_by_id(
-                        contact_id, properties=["firstname", "lastname", "email", "phone", "lifecyclestage"]
-                    )
-        except ApiException as e:
-            print(f"Error fetching contacts for deal {deal.id}:")
+            return fn(*args)
+        except HubSpotHTTPError as e:
+            print(f"Error fetching {what} for deals {deal_ids[0]}..{deal_ids[-1]}:")
             handle_api_exception(e)
+            failures.append((what, deal_ids[0]))
+            return {}
 
-        for activity_type in ['note', 'call', 'meeting']:
-            try:
-                activity_associations = client.crm.deals.associations_api.get_all(deal.id, activity_type)
-                for activity_assoc in activity_associations.results:
-                    activity_id = activity_assoc.id
-                    
-                    activity_api = getattr(client.crm.objects, f"{activity_type}s")
-                    
-                    activity_props = ["hs_timestamp", f"hs_{activity_type}_body"]
-                    if activity_type == 'call':
-                        activity_props.append('hs_call_title')
-                    elif activity_type == 'meeting':
-                        activity_props.append('hs_meeting_title')
-
-                    activity_details = activity_api.basic_api.get_by_id(activity_id, properties=activity_props)
-                    
-                    activity_contact_id = None
-                    contact_details = None
-                    activity_contact_assocs = getattr(client.crm.objects, f"{activity_type}s").associations_api.get_all(activity_id, 'contact')
-                    if activity_contact_assocs.results:
-                        activity_contact_id = activity_contact_assocs.results[0].id
-                        contact_details = contacts_cache.get(activity_contact_id)
-
-                    row = {
-                        'Deal ID': deal.id,
-                        'Deal Name': deal_name,
-                        'Amount': get_property_value(deal, 'amount'),
-                        'Deal Stage': get_property_value(deal, 'dealstage'),
-                        'Pipeline': get_property_value(deal, 'pipeline'),
-                        'Close Date': format_date(get_property_value(deal, 'closedate')),
-                        'Contact ID': activity_contact_id,
-                        'First Name': get_property_value(contact_details, 'firstname'),
-                        'Last Name': get_property_value(contact_details, 'lastname'),
-                        'Email': get_property_value(contact_details, 'email'),
-                        'Phone Number': get_property_value(contact_details, 'phone'),
-                        'Lifecycle Stage': get_property_value(contact_details, 'lifecyclestage'),
-                        'Company ID': get_property_value(company_details, 'hs_object_id'),
-                        'Company Name': get_property_value(company_details, 'name'),
-                        'Company Domain': get_property_value(company_details, 'domain'),
-                        'Company Industry': get_property_value(company_details, 'industry'),
-                        'Company Annual Revenue': get_property_value(company_details, 'annualrevenue'),
-                        'Activity ID': activity_id,
-                        'Activity Type': activity_type.capitalize(),
-                        'Activity Date': format_date(get_property_value(activity_details, 'hs_timestamp'), '%m/%d/%Y %H:%M'),
-                        'Activity Subject': get_property_value(activity_details, 'hs_call_title') or get_property_value(activity_details, 'hs_meeting_title') or f"{activity_type.capitalize()} about {deal_name}",
-                        'Activity Body': get_property_value(activity_details, f"hs_{activity_type}_body")
-                    }
-                    output_data.append(row)
-            except ApiException as e:
-                print(f"Error fetching {activity_type}s for deal {deal.id}:")
-                handle_api_exception(e)
-
-    output_filename = 'hubspot_multi_with_activities.csv'
-    print(f"Writing data to {output_filename}...")
-    if output_data:
-        with open(output_filename, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=csv_headers)
-            writer.writeheader()
-            writer.writerows(output_data)
-        print(f"Successfully wrote data to {output_filename}.")
+    company_assocs = safe("companies", api.batch_read_associations, 'deals', 'companies', deal_ids)
+    contact_assocs = safe("contacts", api.batch_read_associations, 'deals', 'contacts', deal_ids)
+
+    activity_assocs, activities, activity_contacts = {}, {}, {}
+    for activity_type in ACTIVITY_TYPES:
+        object_type = f"{activity_type}s"
+        activity_assocs[activity_type] = safe(object_type, api.batch_read_associations, 'deals', object_type, deal_ids)
+        activity_ids = [a_id for ids in activity_assocs[activity_type].values() for a_id in ids]
+        activities[activity_type] = safe(object_type, api.batch_read_objects, object_type, activity_ids, activity_properties(activity_type))
+        activity_contacts[activity_type] = safe(f"{activity_type} contacts", api.batch_read_associations, object_type, 'contacts', activity_ids)
+
+    # Only fetch entities that are not already in the persistent cache
+    company_ids = {ids[0] for ids in company_assocs.values() if ids}
+    companies = companies_cache.get_many(company_ids)
+    missing_companies = [c_id for c_id in company_ids if c_id not in companies]
+    fetched = safe("companies", api.batch_read_objects, 'companies', missing_companies, COMPANY_PROPERTIES)
+    companies_cache.put_many(fetched)
+    companies.update(fetched)
+
+    contact_ids = {c_id for ids in contact_assocs.values() for c_id in ids}
+    contact_ids.update(ids[0] for assocs in activity_contacts.values() for ids in assocs.values() if ids)
+    contacts = contacts_cache.get_many(contact_ids)
+    missing_contacts = [c_id for c_id in contact_ids if c_id not in contacts]
+    fetched = safe("contacts", api.batch_read_objects, 'contacts', missing_contacts, CONTACT_PROPERTIES)
+    contacts_cache.put_many(fetched)
+    contacts.update(fetched)
+
+    rows = []
+    for deal in deals:
+        company_ids = company_assocs.get(deal.id)
+        company_details = companies.get(company_ids[0]) if company_ids else None
+        for activity_type in ACTIVITY_TYPES:
+            for activity_id in activity_assocs[activity_type].get(deal.id, []):
+                contact_ids = activity_contacts[activity_type].get(activity_id)
+                activity_contact_id = contact_ids[0] if contact_ids else None
+                rows.append(build_row(
+                    deal, company_details, activity_type, activity_id,
+                    activities[activity_type].get(activity_id),
+                    activity_contact_id, contacts.get(activity_contact_id)
+                ))
+    return rows
+
+def fetch_batched(api, contacts_cache, companies_cache, failures, skip_deal_ids=frozenset()):
+    """
+    Batch mode: resolve each page of deals with a handful of batch requests.
+    Pages are processed in parallel while the next pages are still being listed.
+    Yields (last_deal_id_of_page, rows) in deal order, leaving out the deals in
+    `skip_deal_ids` (already written by an interrupted run).
+    """
+    def pages():
+        for deals in api.get_deal_pages(DEAL_PROPERTIES):
+            deals = [deal for deal in deals if deal.id not in skip_deal_ids]
+            if deals:
+                yield deals
+
+    def worker(deals):
+        return deals[-1].id, fetch_deal_batch(api, deals, contacts_cache, companies_cache, failures)
+
+    page_count = 0
+    try:
+        with ThreadPoolExecutor(max_workers=HUBSPOT_CONCURRENCY) as executor:
+            for last_deal_id, rows in ordered_map(executor, worker, pages(), HUBSPOT_CONCURRENCY * 2):
+                page_count += 1
+                print(f"Processed deal page {page_count}: {len(rows)} activities")
+                yield last_deal_id, rows
+    except HubSpotHTTPError as e:
+        handle_api_exception(e)
+        raise ExportAborted() from e
+
+def find_changed_deal_ids(api, state):
+    """
+    Search every synced object type for records modified since its checkpoint
+    and map them back to the deals whose rows they appear in. A contact can
+    also appear in a row as the contact of an activity on a deal it is not
+    associated with, so changed contacts are followed through their
+    activities as well.
+    """
+    changed_deal_ids = set()
+    for object_type in SYNC_OBJECT_TYPES:
+        since = state.get_checkpoint(object_type)
+        property_name = LAST_MODIFIED_PROPERTY.get(object_type, 'hs_lastmodifieddate')
+        changed_ids = [entity.id for entity in api.search_modified_since(object_type, property_name, since)]
+        print(f"{len(changed_ids)} {object_type} changed since last sync")
+        if object_type == 'deals':
+            changed_deal_ids.update(changed_ids)
+        elif changed_ids:
+            for deal_ids in api.batch_read_associations(object_type, 'deals', changed_ids).values():
+                changed_deal_ids.update(deal_ids)
+        if object_type == 'contacts' and changed_ids:
+            for activity_type in ACTIVITY_TYPES:
+                activity_object_type = f"{activity_type}s"
+                contact_activities = api.batch_read_associations('contacts', activity_object_type, changed_ids)
+                activity_ids = list({a_id for ids in contact_activities.values() for a_id in ids})
+                if activity_ids:
+                    for deal_ids in api.batch_read_associations(activity_object_type, 'deals', activity_ids).values():
+                        changed_deal_ids.update(deal_ids)
+    return changed_deal_ids
+
+def fetch_incremental(api, state, contacts_cache, companies_cache, failures):
+    """
+    Incremental mode: re-fetch rows only for deals that changed themselves or
+    whose company, contacts or activities changed. Returns {deal_id: rows}.
+    """
+    try:
+        changed_deal_ids = sorted(find_changed_deal_ids(api, state), key=deal_sort_key)
+        print(f"Re-fetching {len(changed_deal_ids)} affected deals...")
+        rows_by_deal = {deal_id: [] for deal_id in changed_deal_ids}
+
+        def worker(deal_ids):
+            deals = api.batch_read_objects('deals', deal_ids, DEAL_PROPERTIES)
+            # Deals missing from the batch read were deleted/archived; they keep an empty row list
+            present = [deals[deal_id] for deal_id in deal_ids if deal_id in deals]
+            return fetch_deal_batch(api, present, contacts_cache, companies_cache, failures) if present else []
+
+        with ThreadPoolExecutor(max_workers=HUBSPOT_CONCURRENCY) as executor:
+            for rows in ordered_map(executor, worker, chunked(changed_deal_ids), HUBSPOT_CONCURRENCY * 2):
+                for row in rows:
+                    rows_by_deal[row['Deal ID']].append(row)
+    except HubSpotHTTPError as e:
+        handle_api_exception(e)
+        return None
+    return rows_by_deal
+
+def merge_rows(existing_filename, rows_by_deal):
+    """
+    Yield the existing CSV with every changed deal's rows replaced in place
+    (or dropped, if the deal no longer has activities), then rows for deals
+    that were not in the file before.
+    """
+    emitted = set()
+    with open(existing_filename, 'r', newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            deal_id = row['Deal ID']
+            if deal_id not in rows_by_deal:
+                yield row
+            elif deal_id not in emitted:
+                emitted.add(deal_id)
+                yield from rows_by_deal[deal_id]
+    for deal_id, rows in rows_by_deal.items():
+        if deal_id not in emitted:
+            yield from rows
+
+def run_export(api, limiter, state, contacts_cache, companies_cache, run_started_ms):
+    """Run a full (possibly resumed) or incremental export and advance the sync checkpoints."""
+    can_sync_incrementally = os.path.exists(OUTPUT_FILENAME) and all(
+        state.get_checkpoint(object_type) is not None for object_type in SYNC_OBJECT_TYPES
+    )
+    incremental = SYNC_MODE == "incremental" and can_sync_incrementally
+    # (what, deal_id) for every request whose data is missing from the rows; appended to by the workers
+    failures = []
+    if SYNC_MODE == "incremental" and not incremental:
+        print("No previous sync checkpoint found; running a full export first.")
+
+    if incremental:
+        rows_by_deal = fetch_incremental(api, state, contacts_cache, companies_cache, failures)
+        if rows_by_deal is None:
+            return
+        # The merge reads the current CSV while the new one is written to a separate partial file
+        writer = StreamingCsvWriter(OUTPUT_FILENAME, CSV_HEADERS, state, run_started_ms)
+        for row in merge_rows(OUTPUT_FILENAME, rows_by_deal):
+            writer.write_deal_rows(row['Deal ID'], [row])
     else:
+        # A full export picks up from the last durable marker if a previous run was interrupted,
+        # skipping the deals already in the partial file rather than relying on HubSpot's listing order
+        writer = StreamingCsvWriter(OUTPUT_FILENAME, CSV_HEADERS, state, run_started_ms, resumable=True)
+        if FETCH_MODE == "sequential":
+            client = HubSpot(access_token=HUBSPOT_TOKEN)
+            results = fetch_sequential(client, contacts_cache, companies_cache, limiter, failures, writer.written_deal_ids)
+        else:
+            results = fetch_batched(api, contacts_cache, companies_cache, failures, writer.written_deal_ids)
+        try:
+            for last_deal_id, rows in results:
+                writer.write_deal_rows(last_deal_id, rows)
+        except (ExportAborted, KeyboardInterrupt):
+            writer.abort()
+            print(f"Export interrupted; re-run to resume from {writer.partial_path}.")
+            return
+
+    print(f"Writing data to {OUTPUT_FILENAME}...")
+    if writer.rows_written or writer.resume_after:
+        writer.commit()
+        print(f"Successfully wrote data to {OUTPUT_FILENAME}.")
+    else:
+        writer.discard()
         print("No data was fetched to write.")
 
+    if failures:
+        # Rows of these deals are incomplete: keep the old high-water mark so the next
+        # incremental run finds them again. After a full export there is no older mark
+        # that covers them, so the next incremental run falls back to a full export.
+        print(f"{len(failures)} HubSpot requests failed; their deals are incomplete in {OUTPUT_FILENAME}. "
+              "Sync checkpoints were not advanced; re-run to fetch them again.")
+        if not incremental:
+            state.clear_checkpoints()
+        return
+
+    # Only advance the high-water mark once the CSV reflects everything up to it
+    checkpoint = writer.started_ms - CHECKPOINT_OVERLAP_MS
+    state.set_checkpoints({object_type: checkpoint for object_type in SYNC_OBJECT_TYPES})
+
+def main():
+    """
+    Fetches deals, contacts, companies, and activities from HubSpot
+    and writes them to a CSV file named hubspot_multi_with_activities.csv.
+    """
+    if not HUBSPOT_TOKEN:
+        print("HUBSPOT_API_TOKEN not found. Please set it in your .env file.")
+        return
+
+    run_started_ms = int(time.time() * 1000)
+    state = SyncState(HUBSPOT_STATE_FILE)
+
+    # One limiter shared by every worker thread keeps the whole export under HubSpot's burst limit
+    limiter = rate_limiter_per_10s(HUBSPOT_REQUESTS_PER_10S)
+    api = HubSpotBatchClient(HUBSPOT_TOKEN, base_url=HUBSPOT_API_BASE, limiter=limiter, pool_size=HUBSPOT_CONCURRENCY)
+
+    caches = []
+    for object_type in ('contacts', 'companies'):
+        cache = EntityCache(
+            HUBSPOT_CACHE_FILE, object_type, LAST_MODIFIED_PROPERTY.get(object_type, 'hs_lastmodifieddate'),
+            ttl_seconds=HUBSPOT_CACHE_TTL_HOURS * 3600, max_entries=HUBSPOT_CACHE_MAX_ENTRIES,
+        )
+        try:
+            stale = cache.validate(api, run_started_ms - CHECKPOINT_OVERLAP_MS)
+            print(f"Dropped {stale} stale cached {object_type}")
+        except HubSpotHTTPError as e:
+            handle_api_exception(e)
+            for opened in caches + [cache]:
+                opened.close()
+            state.close()
+            return
+        caches.append(cache)
+    contacts_cache, companies_cache = caches
+    try:
+        run_export(api, limiter, state, contacts_cache, companies_cache, run_started_ms)
+    finally:
+        for cache in caches:
+            print(cache.stats())
+            cache.close()
+        state.close()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,85 @@
+import os
+
+import httpx
+
+
+def _h2_installed():
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class SharedTransport:
+    """
+    One pooled, keep-alive HTTP transport for every backend the app calls.
+
+    Each backend gets its own httpx.AsyncClient (so each keeps its own timeout)
+    on top of a single connection pool, which keeps TLS connections to DuckyAI
+    and Groq open between requests instead of handshaking on every chat. With
+    HTTP/2 (needs the `h2` package), concurrent requests to one host share a
+    single connection. Create it when the app starts and aclose() it on shutdown.
+    """
+
+    def __init__(self, max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.0,
+                 http2=True, connect_timeout=5.0):
+        if http2 and not _h2_installed():
+            print("HTTP2 is enabled but the 'h2' package is missing (pip install 'httpx[http2]'); using HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+        self.max_connections = max_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.connect_timeout = connect_timeout
+        self.transport = httpx.AsyncHTTPTransport(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+        )
+        self._clients = []
+        self._sessions = []
+
+    def client(self, timeout):
+        """An httpx.AsyncClient on the shared pool whose requests time out after `timeout` seconds."""
+        client = httpx.AsyncClient(
+            transport=self.transport,
+            timeout=httpx.Timeout(timeout, connect=min(self.connect_timeout, timeout)),
+        )
+        self._clients.append(client)
+        return client
+
+    def aiohttp_session(self, timeout):
+        """
+        A pooled keep-alive aiohttp session with the same limits, for clients
+        built on aiohttp (slack_sdk's AsyncWebClient) rather than httpx.
+        """
+        import aiohttp
+
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=self.keepalive_expiry),
+            timeout=aiohttp.ClientTimeout(total=timeout, connect=self.connect_timeout),
+        )
+        self._sessions.append(session)
+        return session
+
+    async def aclose(self):
+        """Close every client and session handed out, then the pool itself."""
+        for client in self._clients:
+            await client.aclose()
+        for session in self._sessions:
+            await session.close()
+        await self.transport.aclose()
+
+
+def shared_transport_from_env():
+    """Build the transport from HTTP_* settings."""
+    return SharedTransport(
+        max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20")),
+        keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_SECONDS", "30")),
+        http2=os.getenv("HTTP2", "1").lower() not in ("0", "false", "no"),
+        connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "5")),
+    )
@@ -0,0 +1,240 @@
+import random
+import threading
+import time
+import requests
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+HUBSPOT_API_BASE = "https://api.hubapi.com"
+BATCH_SIZE = 100  # HubSpot caps batch read/association inputs at 100 IDs per request
+RETRY_STATUSES = {429, 502, 503, 504}
+MAX_RETRIES = 6
+SEARCH_PAGE_SIZE = 200
+SEARCH_RESULT_CAP = 10000  # the search API refuses to page past 10,000 results per query
+SEARCH_REQUESTS_PER_SECOND = 4  # search has its own, lower limit of 5 requests/second per account
+
+
+class HubSpotHTTPError(Exception):
+    """Raised for non-2xx responses. Mirrors ApiException's status/body so handle_api_exception works on both."""
+
+    def __init__(self, status, body, reason=""):
+        super().__init__(f"({status}) {reason}: {body}")
+        self.status = status
+        self.body = body
+        self.reason = reason
+
+
+class TokenBucket:
+    """Thread-safe token bucket shared by every worker making HubSpot requests."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def rate_limiter_per_10s(requests_per_10s):
+    """
+    HubSpot enforces its burst limit per rolling 10 seconds (100 for most private
+    apps, 190 on Professional/Enterprise). Refill evenly and keep the burst small
+    so a full window never goes far past the limit.
+    """
+    rate = requests_per_10s / 10
+    return TokenBucket(rate=rate, capacity=max(1, int(rate)))
+
+
+def retry_delay(attempt, retry_after=None):
+    """Seconds to wait before retry `attempt`, honoring Retry-After when present."""
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+    return min(60, 2 ** attempt) + random.uniform(0, 1)
+
+
+def call_with_retry(fn, *args, limiter=None, max_retries=MAX_RETRIES, **kwargs):
+    """
+    Call an SDK method under the shared limiter, retrying rate-limited and
+    transient failures instead of letting them drop data.
+    """
+    for attempt in range(max_retries + 1):
+        if limiter:
+            limiter.acquire()
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            status = getattr(e, "status", None)
+            if status not in RETRY_STATUSES or attempt == max_retries:
+                raise
+            headers = getattr(e, "headers", None) or {}
+            delay = retry_delay(attempt, headers.get("Retry-After"))
+            print(f"HubSpot returned {status}; retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def to_epoch_ms(value):
+    """Convert a HubSpot timestamp (ISO 8601 or epoch milliseconds) to epoch milliseconds."""
+    if value is None or value == "":
+        return None
+    if str(value).isdigit():
+        return int(value)
+    dt_obj = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if dt_obj.tzinfo is None:
+        dt_obj = dt_obj.replace(tzinfo=timezone.utc)
+    return int(dt_obj.timestamp() * 1000)
+
+
+def chunked(items, size=BATCH_SIZE):
+    """Yield successive slices of at most `size` items."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def to_entity(result):
+    """Wrap a raw CRM object so get_property_value() treats it like an SDK model."""
+    return SimpleNamespace(id=str(result.get("id")), properties=result.get("properties") or {})
+
+
+class HubSpotBatchClient:
+    """
+    Minimal HubSpot REST client built around the v3 batch-read and v4 batch
+    association endpoints. The base URL is configurable so the exporter can be
+    pointed at a local fake HubSpot server.
+    """
+
+    def __init__(self, access_token, base_url=None, timeout=30, limiter=None, max_retries=MAX_RETRIES, pool_size=10):
+        self.base_url = (base_url or HUBSPOT_API_BASE).rstrip("/")
+        self.timeout = timeout
+        self.limiter = limiter
+        self.search_limiter = TokenBucket(rate=SEARCH_REQUESTS_PER_SECOND, capacity=1)
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json",
+        })
+        # One connection per worker thread so concurrent batches don't queue on the pool
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method, path, extra_limiter=None, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            if self.limiter:
+                self.limiter.acquire()
+            if extra_limiter:
+                extra_limiter.acquire()
+            response = self.session.request(method, f"{self.base_url}{path}", timeout=self.timeout, **kwargs)
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                delay = retry_delay(attempt, response.headers.get("Retry-After"))
+                print(f"HubSpot returned {response.status_code} for {path}; retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            if response.status_code >= 400:
+                raise HubSpotHTTPError(response.status_code, response.text, response.reason)
+            return response.json() if response.content else {}
+
+    def get_deal_pages(self, properties, limit=100):
+        """Yield deals one page (up to `limit` deals) at a time."""
+        after = None
+        while True:
+            params = {"limit": limit, "properties": ",".join(properties)}
+            if after:
+                params["after"] = after
+            page = self.request("GET", "/crm/v3/objects/deals", params=params)
+            yield [to_entity(result) for result in page.get("results", [])]
+            after = ((page.get("paging") or {}).get("next") or {}).get("after")
+            if not after:
+                break
+
+    def batch_read_associations(self, from_type, to_type, ids):
+        """
+        Resolve associations for many objects at once.
+        Returns {from_id: [to_id, ...]} preserving HubSpot's association order.
+        """
+        associations = {}
+        for batch in chunked(list(dict.fromkeys(ids))):
+            payload = {"inputs": [{"id": object_id} for object_id in batch]}
+            data = self.request("POST", f"/crm/v4/associations/{from_type}/{to_type}/batch/read", json=payload)
+            for result in data.get("results", []):
+                from_id = str(result["from"]["id"])
+                to_ids = [str(to["toObjectId"]) for to in result.get("to", [])]
+                after = ((result.get("paging") or {}).get("next") or {}).get("after")
+                # Objects with more associations than fit in one batch response page on their own
+                while after:
+                    page = self.request(
+                        "GET", f"/crm/v4/objects/{from_type}/{from_id}/associations/{to_type}",
+                        params={"limit": 500, "after": after},
+                    )
+                    to_ids.extend(str(to["toObjectId"]) for to in page.get("results", []))
+                    after = ((page.get("paging") or {}).get("next") or {}).get("after")
+                associations[from_id] = to_ids
+        return associations
+
+    def batch_read_objects(self, object_type, ids, properties):
+        """Read many CRM objects by ID. Returns {id: entity}."""
+        objects = {}
+        for batch in chunked(list(dict.fromkeys(ids))):
+            payload = {"properties": properties, "inputs": [{"id": object_id} for object_id in batch]}
+            data = self.request("POST", f"/crm/v3/objects/{object_type}/batch/read", json=payload)
+            for result in data.get("results", []):
+                entity = to_entity(result)
+                objects[entity.id] = entity
+        return objects
+
+    def search_modified_since(self, object_type, property_name, since_ms, properties=None):
+        """
+        Yield objects whose `property_name` timestamp is later than `since_ms`,
+        oldest first. Because search stops paging at 10,000 results, long result
+        sets are walked in windows that restart from the last timestamp seen.
+        """
+        seen = set()
+        lower, operator = since_ms, "GT"
+        while True:
+            after = 0
+            last_value = None
+            while True:
+                payload = {
+                    "filterGroups": [{"filters": [{"propertyName": property_name, "operator": operator, "value": str(lower)}]}],
+                    "sorts": [{"propertyName": property_name, "direction": "ASCENDING"}],
+                    "properties": list(properties or []) + [property_name],
+                    "limit": SEARCH_PAGE_SIZE,
+                    "after": after,
+                }
+                data = self.request(
+                    "POST", f"/crm/v3/objects/{object_type}/search",
+                    extra_limiter=self.search_limiter, json=payload,
+                )
+                for result in data.get("results", []):
+                    entity = to_entity(result)
+                    last_value = entity.properties.get(property_name) or last_value
+                    if entity.id not in seen:
+                        seen.add(entity.id)
+                        yield entity
+                after = ((data.get("paging") or {}).get("next") or {}).get("after")
+                if not after:
+                    return
+                after = int(after)
+                if after + SEARCH_PAGE_SIZE > SEARCH_RESULT_CAP:
+                    break
+            next_lower = to_epoch_ms(last_value)
+            if next_lower is None or (operator == "GTE" and next_lower == lower):
+                print(f"Warning: more than {SEARCH_RESULT_CAP} {object_type} share one {property_name}; some may be skipped")
+                return
+            lower, operator = next_lower, "GTE"
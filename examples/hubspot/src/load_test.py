@@ -0,0 +1,172 @@
+"""
+Load test for the /chat endpoint against stubbed DuckyAI and Groq backends.
+
+The stubs just sleep for a fixed latency, so throughput should grow with the
+number of requests in flight. If a handler blocked the event loop it would
+stay at about one request per (retrieval + generation) latency. No API keys
+or network access are needed:
+
+    python src/load_test.py --requests 200 --concurrency 1 10 50
+    python src/load_test.py --sync-retrieval   # exercise the thread-pool fallback
+    python src/load_test.py --stream           # /chat/stream: time to first token vs. full reply
+"""
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+import httpx
+import uvicorn
+
+RETRIEVE_LATENCY = 0.2
+GENERATE_LATENCY = 0.5
+STREAM_TOKENS = 20  # a streamed reply spreads GENERATE_LATENCY over this many chunks
+
+
+class FakeDocuments:
+    async def retrieve_async(self, **kwargs):
+        await asyncio.sleep(RETRIEVE_LATENCY)
+        return self._result()
+
+    def retrieve(self, **kwargs):
+        time.sleep(RETRIEVE_LATENCY)
+        return self._result()
+
+    @staticmethod
+    def _result():
+        return SimpleNamespace(documents=[SimpleNamespace(content_chunks=["stub context"])])
+
+
+class SyncOnlyDocuments(FakeDocuments):
+    retrieve_async = None
+
+
+class FakeDuckyAI:
+    documents_class = FakeDocuments
+
+    def __init__(self, **kwargs):
+        self.documents = self.documents_class()
+
+
+class FakeStream:
+    def __init__(self):
+        self.sent = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.sent == STREAM_TOKENS:
+            raise StopAsyncIteration
+        await asyncio.sleep(GENERATE_LATENCY / STREAM_TOKENS)
+        self.sent += 1
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=f"token{self.sent} "))])
+
+    async def close(self):
+        pass
+
+
+class FakeCompletions:
+    async def create(self, stream=False, **kwargs):
+        if stream:
+            return FakeStream()
+        await asyncio.sleep(GENERATE_LATENCY)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="stub reply"))])
+
+
+class FakeAsyncGroq:
+    def __init__(self, **kwargs):
+        self.chat = SimpleNamespace(completions=FakeCompletions())
+
+    async def close(self):
+        pass
+
+
+def load_app(sync_retrieval):
+    if sync_retrieval:
+        FakeDuckyAI.documents_class = SyncOnlyDocuments
+    # Import the app the way `uvicorn src.app:app` does, from the example's root directory
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    # The clients are created when the server starts, so the stubs stay patched in for the whole run.
+    # Bolt and its Socket Mode connection are replaced too, so real Slack tokens in .env are never used.
+    mock.patch("duckyai.DuckyAI", FakeDuckyAI).start()
+    mock.patch("groq.AsyncGroq", FakeAsyncGroq).start()
+    mock.patch("slack_bolt.async_app.AsyncApp").start()
+    mock.patch("slack_bolt.adapter.socket_mode.async_handler.AsyncSocketModeHandler",
+               return_value=mock.AsyncMock()).start()
+    from src import app
+    if sync_retrieval:
+        # hasattr() is what ChatService.retrieve_uncached checks, so remove the attribute entirely
+        del SyncOnlyDocuments.retrieve_async
+    return app.app
+
+
+def serve(app):
+    """Run the app under a real uvicorn server on a free local port (so streamed responses aren't buffered)."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+async def run(base_url, total, concurrency, stream=False, distinct=None):
+    """Send `total` chats, `concurrency` at a time. Returns (elapsed, mean seconds to the first reply text)."""
+    limit = asyncio.Semaphore(concurrency)
+    first_byte = []
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=httpx.Limits(max_connections=concurrency)) as http:
+        async def one(i):
+            question = f"question {i % (distinct or total)}"
+            async with limit:
+                sent = time.perf_counter()
+                if not stream:
+                    response = await http.post("/chat", json={"message": question})
+                    response.raise_for_status()
+                    first_byte.append(time.perf_counter() - sent)
+                    return
+                async with http.stream("POST", "/chat/stream", json={"message": question}) as response:
+                    response.raise_for_status()
+                    first = None
+                    async for line in response.aiter_lines():
+                        if first is None and line.startswith('data: {"token"'):
+                            first = time.perf_counter() - sent
+                    first_byte.append(first)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        return time.perf_counter() - started, sum(first_byte) / len(first_byte)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /chat against stubbed backends")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--sync-retrieval", action="store_true",
+                        help="stub a sync-only DuckyAI SDK so retrieval goes through the thread pool")
+    parser.add_argument("--stream", action="store_true", help="load test /chat/stream instead of /chat")
+    parser.add_argument("--distinct", type=int,
+                        help="cycle through this many different questions (default: all different, so nothing is cached)")
+    args = parser.parse_args()
+
+    base_url = serve(load_app(args.sync_retrieval))
+    per_request = RETRIEVE_LATENCY + GENERATE_LATENCY
+    print(f"Backend latency per request: {per_request:.1f}s (a blocking handler tops out at {1 / per_request:.1f} req/s)")
+    for concurrency in args.concurrency:
+        total = max(args.requests // 10, concurrency) if concurrency == 1 else args.requests
+        elapsed, first_byte = asyncio.run(run(base_url, total, concurrency, args.stream, args.distinct))
+        print(f"concurrency {concurrency:>4}: {total:>5} requests in {elapsed:6.2f}s "
+              f"= {total / elapsed:7.1f} req/s ({total * per_request / elapsed:5.1f} requests overlapped), "
+              f"first reply text after {first_byte * 1000:.0f}ms")
+    print("Cache stats:", httpx.get(f"{base_url}/cache/stats").json())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import re
+import sqlite3
+import time
+
+
+def stable_doc_id(*parts):
+    """Build a DuckyAI-safe document ID that stays the same across runs."""
+    return re.sub(r"[^A-Za-z0-9_-]+", "-", "-".join(str(part) for part in parts)).strip("-")
+
+
+def content_hash(content, metadata=None):
+    """Hash of everything that ends up in the index for a document."""
+    payload = json.dumps({"content": content, "metadata": metadata or {}}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class IndexManifest:
+    """
+    Local record of what has been indexed: for each (index, doc_id) the content
+    hash, when it was last indexed and the source (e.g. the export file) it came
+    from. Lets add_knowledge skip unchanged documents, re-index modified ones
+    under the same doc_id, and find documents that have disappeared from the
+    source being ingested, without touching those of other sources sharing the index.
+
+    Rows recorded before sources were tracked are assigned to `legacy_source`.
+
+    Writes are committed every COMMIT_EVERY records and on close(), not once
+    per document. Records lost in a crash only mean those documents are indexed
+    again on the next run.
+    """
+
+    COMMIT_EVERY = 1000
+
+    def __init__(self, path, index_name, source, legacy_source=None):
+        self.index_name = index_name
+        self.source = source
+        self.seen = set()
+        self._pending = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " index_name TEXT NOT NULL,"
+            " doc_id TEXT NOT NULL,"
+            " content_hash TEXT NOT NULL,"
+            " indexed_at REAL NOT NULL,"
+            " source TEXT NOT NULL DEFAULT '',"
+            " PRIMARY KEY (index_name, doc_id))"
+        )
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(documents)")]
+        if "source" not in columns:
+            self.conn.execute("ALTER TABLE documents ADD COLUMN source TEXT NOT NULL DEFAULT ''")
+            self.conn.execute("UPDATE documents SET source = ?", (legacy_source or source,))
+        self.conn.commit()
+
+    def is_unchanged(self, doc_id, doc_hash):
+        """Mark `doc_id` as present in the source and report whether its indexed copy is current."""
+        self.seen.add(doc_id)
+        row = self.conn.execute(
+            "SELECT content_hash FROM documents WHERE index_name = ? AND doc_id = ?",
+            (self.index_name, doc_id),
+        ).fetchone()
+        return row is not None and row[0] == doc_hash
+
+    def record(self, doc_id, doc_hash):
+        """Remember that `doc_id` was indexed with this content."""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO documents (index_name, doc_id, content_hash, indexed_at, source)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (self.index_name, doc_id, doc_hash, time.time(), self.source),
+        )
+        self._written()
+
+    def missing_doc_ids(self):
+        """Documents indexed from this source by an earlier run that were not seen in this one."""
+        rows = self.conn.execute(
+            "SELECT doc_id FROM documents WHERE index_name = ? AND source = ?", (self.index_name, self.source)
+        ).fetchall()
+        return [doc_id for (doc_id,) in rows if doc_id not in self.seen]
+
+    def forget(self, doc_id):
+        self.conn.execute(
+            "DELETE FROM documents WHERE index_name = ? AND doc_id = ?", (self.index_name, doc_id)
+        )
+        self._written()
+
+    def _written(self):
+        self._pending += 1
+        if self._pending >= self.COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        """Make every record so far durable."""
+        self.conn.commit()
+        self._pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+def delete_missing_documents(client, index_name, manifest):
+    """
+    Delete documents of the manifest's source that no longer exist there from the index and the manifest.
+    Returns how many were deleted; failed deletes stay in the manifest and are retried next run.
+    """
+    deleted = 0
+    for doc_id in manifest.missing_doc_ids():
+        try:
+            client.documents.delete(index_name=index_name, doc_id=doc_id)
+            manifest.forget(doc_id)
+            deleted += 1
+        except Exception as e:
+            print(f"Failed to delete {doc_id}: {e}")
+    return deleted
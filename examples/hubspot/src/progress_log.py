@@ -0,0 +1,97 @@
+import json
+import os
+from collections import deque
+
+FSYNC_EVERY = 100
+
+
+class ProgressLog:
+    """
+    Append-only progress log for add_knowledge. Once every document produced
+    from a source row has been acknowledged by DuckyAI, one JSON line is
+    appended with the row number, the position to continue reading from and
+    the doc IDs it produced. Lines are written in source order, so the last
+    line is always the first row that still needs indexing.
+
+    The first line identifies the source file (path, size, mtime); --resume
+    only continues from a log written for the same file.
+    """
+
+    def __init__(self, path, source_path, resume=False):
+        self.path = path
+        self.offset = None
+        self.row = 0
+        self.doc_ids = set()
+        self._pending = deque()
+        self._waiting = {}
+        self._unsynced = 0
+
+        stat = os.stat(source_path)
+        source = {"source": os.path.abspath(source_path), "size": stat.st_size, "mtime": stat.st_mtime}
+        if resume and self._load(source):
+            self.file = open(path, "a", encoding="utf-8")
+            print(f"Resuming from row {self.row} ({len(self.doc_ids)} documents already indexed)")
+        else:
+            if resume:
+                print(f"No usable progress log for {source_path}; starting from the beginning")
+            self.file = open(path, "w", encoding="utf-8")
+            self.file.write(json.dumps(source) + "\n")
+            self.file.flush()
+
+    def _load(self, source):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, "rb") as f:
+            lines = f.readlines()
+        if not lines or json.loads(lines[0]) != source:
+            return False
+        intact = len(lines[0])
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break  # torn final line from a crash; everything before it is intact
+            if not line.endswith(b"\n"):
+                break
+            self.offset = record["offset"]
+            self.row = record["row"] + 1
+            self.doc_ids.update(record["doc_ids"])
+            intact += len(line)
+        # Cut the torn line off, otherwise new records would be appended after
+        # it and the next resume would stop there again.
+        with open(self.path, "r+b") as f:
+            f.truncate(intact)
+        return True
+
+    def add_row(self, row, next_offset, doc_ids=()):
+        """Register a source row before its documents are sent."""
+        entry = {"row": row, "offset": next_offset, "doc_ids": list(doc_ids), "waiting": set(doc_ids)}
+        self._pending.append(entry)
+        for doc_id in entry["waiting"]:
+            self._waiting[doc_id] = entry
+        self._drain()
+
+    def ack(self, doc_id):
+        """Mark a document as done (indexed, or given up on after retries)."""
+        entry = self._waiting.pop(doc_id, None)
+        if entry:
+            entry["waiting"].discard(doc_id)
+            self._drain()
+
+    def _drain(self):
+        while self._pending and not self._pending[0]["waiting"]:
+            entry = self._pending.popleft()
+            record = {"row": entry["row"], "offset": entry["offset"], "doc_ids": entry["doc_ids"]}
+            self.file.write(json.dumps(record) + "\n")
+            self._unsynced += 1
+        if self._unsynced >= FSYNC_EVERY:
+            self._sync()
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self._unsynced = 0
+
+    def close(self):
+        self._sync()
+        self.file.close()
@@ -0,0 +1,67 @@
+import sqlite3
+
+
+class SyncState:
+    """
+    Local SQLite file holding the incremental-sync high-water marks
+    (epoch milliseconds of hs_lastmodifieddate) for each HubSpot object type,
+    and the resume marker of an in-progress CSV export.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            " object_type TEXT PRIMARY KEY,"
+            " last_modified_ms INTEGER NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS export_progress ("
+            " output_path TEXT PRIMARY KEY,"
+            " last_deal_id TEXT NOT NULL,"
+            " byte_offset INTEGER NOT NULL,"
+            " started_ms INTEGER NOT NULL)"
+        )
+        self.conn.commit()
+
+    def get_checkpoint(self, object_type):
+        row = self.conn.execute(
+            "SELECT last_modified_ms FROM checkpoints WHERE object_type = ?", (object_type,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_checkpoints(self, checkpoints):
+        """Save {object_type: last_modified_ms} atomically."""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO checkpoints (object_type, last_modified_ms) VALUES (?, ?) "
+                "ON CONFLICT(object_type) DO UPDATE SET last_modified_ms = excluded.last_modified_ms",
+                list(checkpoints.items()),
+            )
+
+    def clear_checkpoints(self):
+        """Forget every high-water mark, so the next incremental run starts with a full export."""
+        with self.conn:
+            self.conn.execute("DELETE FROM checkpoints")
+
+    def get_export_progress(self, output_path):
+        """Return (last_deal_id, byte_offset, started_ms) for an interrupted export, or None."""
+        return self.conn.execute(
+            "SELECT last_deal_id, byte_offset, started_ms FROM export_progress WHERE output_path = ?", (output_path,)
+        ).fetchone()
+
+    def set_export_progress(self, output_path, last_deal_id, byte_offset, started_ms):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO export_progress (output_path, last_deal_id, byte_offset, started_ms)"
+                " VALUES (?, ?, ?, ?)",
+                (output_path, last_deal_id, byte_offset, started_ms),
+            )
+
+    def clear_export_progress(self, output_path):
+        with self.conn:
+            self.conn.execute("DELETE FROM export_progress WHERE output_path = ?", (output_path,))
+
+    def close(self):
+        self.conn.close()
@@ -4,6 +4,19 @@ from duckyai import DuckyAI
 import os
 # Import dotenv for loading environment variables from a .env file
 from dotenv import load_dotenv
+# Import argparse for command-line options
+import argparse
+# Import the manifest used to skip documents that have not changed since the last run
+from manifest import IndexManifest, content_hash, delete_missing_documents, stable_doc_id
+# Import the index version used to invalidate the apps' retrieval caches
+from retrieval_cache import bump_index_version
+
+# Parse command-line options
+parser = argparse.ArgumentParser(description="Index meeting transcripts and policies into DuckyAI")
+parser.add_argument("--delete-missing", action="store_true",
+                    help="delete documents indexed from files that are no longer configured")
+args = parser.parse_args()
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -26,6 +39,32 @@ policies_file_path = os.getenv("POLICIES_FILE_PATH")
 if policies_file_path is None:
     raise ValueError("POLICIES_FILE_PATH environment variable not set")
 
+# The manifest remembers the content hash of every document indexed so far
+# Both configured files form one source, so --delete-missing removes files that are no longer configured
+manifest = IndexManifest(os.getenv("DUCKY_MANIFEST_PATH", "data/index_manifest.db"), ducky_index_name, source="meetings")
+
+
+def index_file(file_path, content):
+    """Index a file under a doc_id derived from its name, skipping it if unchanged. Returns True if it was indexed."""
+    doc_id = stable_doc_id("meetings", os.path.basename(file_path))
+    doc_hash = content_hash(content)
+    if manifest.is_unchanged(doc_id, doc_hash):
+        print(f"{file_path} is unchanged, skipping")
+        return False
+    # Index the document using the Ducky AI client
+    # A modified file is re-indexed under the same doc_id
+    client.documents.index(
+        # Specify the name of the index, this can be found in the Ducky AI dashboard
+        index_name=ducky_index_name,
+        # Provide the content to be indexed
+        content=content,
+        # Stable ID so later runs update this document instead of adding a new one
+        doc_id=doc_id,
+    )
+    manifest.record(doc_id, doc_hash)
+    return True
+
+
 # Initialize an empty string to store the transcript content
 transcript_content= ""
 # Open the transcript.txt file in read mode with utf-8 encoding
@@ -33,13 +72,8 @@ with open(transcript_file_path, 'r', encoding='utf-8') as f:
     # Read the entire content of the file into transcript_content
     transcript_content = f.read()
 
-# Index the transcript document using the Ducky AI client
-client.documents.index(
-    # Specify the name of the index, this can be found in the Ducky AI dashboard
-    index_name=ducky_index_name,
-    # Provide the content to be indexed
-    content=transcript_content,
-)
+# Index the transcript document
+changed = index_file(transcript_file_path, transcript_content)
 
 # Initialize an empty string to store the policies content
 policies_content= ""
@@ -48,10 +82,16 @@ with open(policies_file_path, 'r', encoding='utf-8') as f:
     # Read the entire content of the file into policies_content
     policies_content = f.read()
 
-# Index the policies document using the Ducky AI client
-client.documents.index(
-    # Specify the name of the index, this can be found in the Ducky AI dashboard
-    index_name=ducky_index_name,
-    # Provide the content to be indexed
-    content=policies_content,
-)
\ No newline at end of file
+# Index the policies document
+changed = index_file(policies_file_path, policies_content) or changed
+
+# Optionally remove documents from files that are no longer configured
+if args.delete_missing:
+    deleted = delete_missing_documents(client, ducky_index_name, manifest)
+    print(f"Deleted {deleted} documents no longer present")
+    changed = changed or deleted > 0
+manifest.close()
+
+# Tell running apps to stop serving retrieval results cached before this run
+if changed:
+    bump_index_version(os.getenv("DUCKY_INDEX_VERSION_FILE", "data/index_version.json"), ducky_index_name)
@@ -1,19 +1,65 @@
+import asyncio
+import functools
+import json
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 import groq
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from duckyai import DuckyAI
 from fastapi.middleware.cors import CORSMiddleware
+from src.context_builder import build_context, load_encoding
+from src.completion_cache import completion_cache_from_env, completion_key
+from src.http_transport import shared_transport_from_env
+from src.retrieval_cache import retrieval_cache_from_env
 
 #load environment variables
 import os
 from dotenv import load_dotenv
 load_dotenv()
 
+# Timeouts for each backend call, and for a whole /chat request
+DUCKY_TIMEOUT_MS = int(os.getenv("DUCKY_TIMEOUT_MS", "10000"))
+GROQ_TIMEOUT_SECONDS = float(os.getenv("GROQ_TIMEOUT_SECONDS", "30"))
+CHAT_TIMEOUT_SECONDS = float(os.getenv("CHAT_TIMEOUT_SECONDS", "45"))
+# Threads for DuckyAI retrieval, only used if the installed SDK has no async methods
+RETRIEVAL_WORKERS = int(os.getenv("DUCKY_RETRIEVAL_WORKERS", "16"))
+# Documents to retrieve per question; the index holds the transcript and the handbook, so 2 covers both
+TOP_K = int(os.getenv("DUCKY_TOP_K", "2"))
+# Tokens of retrieved context to put in the prompt, leaving the rest of the model's window for the reply
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "4000"))
+retrieval_pool = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global client, groq_client
+    # The tokenizer may be downloaded on first load; do it now, off the event loop
+    await asyncio.to_thread(load_encoding)
+    # One pooled keep-alive HTTP transport, shared by the DuckyAI and Groq clients
+    transport = shared_transport_from_env()
+    # Initialize the DuckyAI client using the API key from environment variables
+    # Its async methods (used for retrieval) go through the shared transport
+    client = DuckyAI(api_key=os.getenv("DUCKY_API_KEY"), async_client=transport.client(DUCKY_TIMEOUT_MS / 1000))
+    # Initialize the async Groq client using the API key from environment variables
+    # Awaiting it frees the event loop while the model generates, so many chats can run at once
+    groq_client = groq.AsyncGroq(
+        api_key=os.getenv("GROQ_API_KEY"),
+        timeout=GROQ_TIMEOUT_SECONDS,
+        http_client=transport.client(GROQ_TIMEOUT_SECONDS),
+    )
+    yield
+    # Drop queued retrievals and close the connection pool on shutdown
+    retrieval_pool.shutdown(wait=False, cancel_futures=True)
+    await transport.aclose()
+    if completion_cache is not None:
+        completion_cache.close()
+
 
 # Create an instance of the FastAPI application
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS (Cross-Origin Resource Sharing) middleware
 # This allows requests from any origin, with any method and any headers.
@@ -43,13 +89,72 @@ async def read_root():
     # Return an HTML response with the content of index.html
     return HTMLResponse(content=html_content, status_code=200)
 
-# Initialize the DuckyAI client using the API key from environment variables
-client = DuckyAI(api_key=os.getenv("DUCKY_API_KEY"))
+# The DuckyAI and Groq clients are created on startup, in lifespan(), together with their HTTP transport
+client = None
+groq_client = None
 # Get the index name from environment variables with a fallback
 index_name = os.getenv("DUCKY_INDEX_NAME", "ducky-test")
 
-# Initialize the Groq client using the API key from environment variables
-groq_client = groq.Client(api_key=os.getenv("GROQ_API_KEY"))
+
+class ClientDisconnected(Exception):
+    """The caller went away before the reply was ready."""
+
+
+# Cache of recent retrieval results, so repeated questions skip the DuckyAI round trip
+# Set RETRIEVAL_CACHE_SIZE=0 to disable it
+retrieval_cache = retrieval_cache_from_env()
+
+# Opt-in disk cache of Groq replies for identical (model, context, question)
+# Enable it with COMPLETION_CACHE_SIZE=<max replies>
+completion_cache = completion_cache_from_env()
+
+
+async def cached_reply(model, messages):
+    """Return (cache key, earlier reply for the same model, context and question); (None, None) when caching is off."""
+    if completion_cache is None:
+        return None, None
+    key = completion_key(model, messages[0]["content"], messages[-1]["content"])
+    return key, await completion_cache.get(key)
+
+
+async def retrieve(query, top_k):
+    """Retrieve documents from DuckyAI, using the retrieval cache when it is enabled."""
+    if retrieval_cache is None:
+        return await retrieve_uncached(query, top_k)
+    return await retrieval_cache.get_or_retrieve(
+        index_name, query, top_k, lambda: retrieve_uncached(query, top_k)
+    )
+
+
+async def retrieve_uncached(query, top_k):
+    """Retrieve documents from DuckyAI without blocking the event loop."""
+    if hasattr(client.documents, "retrieve_async"):
+        return await client.documents.retrieve_async(
+            index_name=index_name, query=query, top_k=top_k, timeout_ms=DUCKY_TIMEOUT_MS
+        )
+    # Older SDKs are sync-only; run them on a bounded pool instead of the event loop
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        retrieval_pool,
+        functools.partial(client.documents.retrieve, index_name=index_name, query=query, top_k=top_k),
+    )
+
+
+async def run_cancellable(request, coro, timeout):
+    """
+    Await `coro`, but give up after `timeout` seconds or as soon as the client
+    disconnects. Giving up cancels the in-flight DuckyAI/Groq calls.
+    """
+    task = asyncio.ensure_future(asyncio.wait_for(coro, timeout))
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=0.5)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise ClientDisconnected()
+    finally:
+        task.cancel()
 
 
 # Define a Pydantic model for the chat message request body
@@ -57,44 +162,158 @@ groq_client = groq.Client(api_key=os.getenv("GROQ_API_KEY"))
 class ChatMessage(BaseModel):
     message: str
 
-# Define a POST endpoint for "/chat" to handle chat messages
-@app.post("/chat")
-async def chat(msg: ChatMessage):
+# Reply used when DuckyAI finds nothing relevant
+NO_CONTEXT_REPLY = "Sorry, I don't know how to respond yet."
+
+# Retrieve context and build the prompt for one chat message
+# Returns None when no relevant documents are found
+async def build_messages(message):
     # Retrieve relevant documents from DuckyAI based on the user's message
-    results = client.documents.retrieve(
-        index_name=index_name,  # The name of the DuckyAI index to search
-        query=msg.message,      # The user's message to use as the search query
-        top_k=1                 # Retrieve only the top 1 most relevant document
+    results = await retrieve(
+        message,   # The user's message to use as the search query
+        top_k=TOP_K
     )
 
     # Check if any documents were found
-    if results.documents:
-        # If documents are found, extract context from the first document's content_chunks
-        # It joins all content_chunks into a single string.
-        # If there are no content_chunks, it defaults to an empty string.
-        context = " ".join(results.documents[0].content_chunks) if results.documents[0].content_chunks else ""
-
-        # Use the Groq API to generate a chat completion (response)
-        completion = groq_client.chat.completions.create(
-            model=os.getenv("GROQ_MODEL_NAME", "llama3-70b-8192"),
-            messages=[
-            {
-                "role": "system",
-                "content": f"""You are a helpful assistant. 
-                Always respond in markdown format.
-                Use the provided context to answer questions accurately.
-                For casual greetings, general conversation, or questions 
-                unrelated to the context, respond naturally without referencing the context. 
-                Context (use only if relevant): {context}"""
-            },
-            {"role": "user", "content": msg.message}
-            ]
-        )
-        # Extract the reply from the model's response
-        reply = completion.choices[0].message.content
-    else:
+    if not results.documents:
+        return None
+
+    # Rank the chunks of every retrieved document, drop repeated ones and keep
+    # the best that fit in CONTEXT_TOKEN_BUDGET tokens
+    context = build_context(results, message, CONTEXT_TOKEN_BUDGET)
+
+    return [
+        {
+            "role": "system",
+            "content": f"""You are a helpful assistant. 
+            Always respond in markdown format.
+            Use the provided context to answer questions accurately.
+            For casual greetings, general conversation, or questions 
+            unrelated to the context, respond naturally without referencing the context. 
+            Context (use only if relevant): {context}"""
+        },
+        {"role": "user", "content": message}
+    ]
+
+# Retrieve context and generate a reply for one chat message
+async def answer(message):
+    messages = await build_messages(message)
+    if messages is None:
         # If no relevant documents are found by DuckyAI, provide a default response
-        reply = "Sorry, I don't know how to respond yet."
+        return NO_CONTEXT_REPLY
+
+    model = os.getenv("GROQ_MODEL_NAME", "llama3-70b-8192")
+    # Reuse the reply to an identical question over identical context, if caching is enabled
+    key, reply = await cached_reply(model, messages)
+    if reply is not None:
+        return reply
+
+    # Use the Groq API to generate a chat completion (response)
+    completion = await groq_client.chat.completions.create(
+        model=model,
+        messages=messages
+    )
+    # Extract the reply from the model's response
+    reply = completion.choices[0].message.content
+    if key is not None:
+        await completion_cache.set(key, model, reply)
+    return reply
+
+# Same as answer(), but yields the reply piece by piece as Groq generates it
+async def stream_answer(message):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + CHAT_TIMEOUT_SECONDS
+
+    # Every await gets whatever is left of the request's time budget
+    def remaining():
+        return max(0.0, deadline - loop.time())
+
+    messages = await asyncio.wait_for(build_messages(message), remaining())
+    if messages is None:
+        yield NO_CONTEXT_REPLY
+        return
+
+    model = os.getenv("GROQ_MODEL_NAME", "llama3-70b-8192")
+    # A cached reply is sent as a single chunk
+    key, reply = await asyncio.wait_for(cached_reply(model, messages), remaining())
+    if reply is not None:
+        yield reply
+        return
+
+    stream = await asyncio.wait_for(
+        groq_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True
+        ),
+        remaining()
+    )
+    tokens = []
+    try:
+        while True:
+            try:
+                chunk = await asyncio.wait_for(anext(stream), remaining())
+            except StopAsyncIteration:
+                break
+            token = chunk.choices[0].delta.content if chunk.choices else None
+            if token:
+                tokens.append(token)
+                yield token
+        # Only a reply that streamed to the end is cached
+        if key is not None:
+            await completion_cache.set(key, model, "".join(tokens))
+    finally:
+        # Closes the HTTP response, so a client that disconnects stops generation too
+        await stream.close()
+
+# Format one Server-Sent Event
+def sse(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+# Report retrieval and completion cache hit rates and sizes
+@app.get("/cache/stats")
+async def cache_stats():
+    return JSONResponse(content={
+        "retrieval": retrieval_cache.stats() if retrieval_cache else None,
+        "completion": completion_cache.stats() if completion_cache else None,
+    })
+
+# Define a POST endpoint for "/chat" to handle chat messages
+@app.post("/chat")
+async def chat(msg: ChatMessage, request: Request):
+    try:
+        reply = await run_cancellable(request, answer(msg.message), CHAT_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        return JSONResponse(content={"response": "Sorry, that took too long. Please try again."}, status_code=504)
+    except ClientDisconnected:
+        # Nobody is listening any more; 499 is the conventional "client closed request" status
+        return Response(status_code=499)
 
     # Return the reply as a JSON response
-    return JSONResponse(content={"response": reply})
\ No newline at end of file
+    return JSONResponse(content={"response": reply})
+
+
+# Define a POST endpoint for "/chat/stream" that sends the reply as Server-Sent Events
+# Each event carries {"token": "..."}; a final "done" event (or an "error" event) ends the stream.
+# Starlette cancels the generator when the client disconnects, which also stops the Groq stream.
+@app.post("/chat/stream")
+async def chat_stream(msg: ChatMessage):
+    async def events():
+        try:
+            async for token in stream_answer(msg.message):
+                yield sse({"token": token})
+        except asyncio.TimeoutError:
+            yield sse({"error": "Sorry, that took too long. Please try again."}, event="error")
+            return
+        except Exception as e:
+            yield sse({"error": str(e)}, event="error")
+            return
+        yield sse({}, event="done")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Stop proxies (e.g. nginx) from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_query(query):
+    """Case-fold, collapse whitespace and drop surrounding punctuation, so near-identical questions share an entry."""
+    return re.sub(r"\s+", " ", query.casefold()).strip().strip("?!.,;:'\" ")
+
+
+def read_index_version(path, index_name):
+    """Return the version add_knowledge last recorded for `index_name` (0 if none)."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get(index_name, 0)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return 0
+
+
+def bump_index_version(path, index_name):
+    """
+    Record that `index_name` was re-indexed. Running apps notice the new
+    version and stop serving retrieval results cached before it.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            versions = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        versions = {}
+    # A timestamp rather than a counter, so two runs can never produce the same version
+    versions[index_name] = time.time_ns()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(versions, f)
+    os.replace(tmp_path, path)
+    return versions[index_name]
+
+
+class MemoryBackend:
+    """In-process LRU with per-entry expiry. The default backend."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    async def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def size(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """
+    Shared backend, so every worker and replica reuses the same results.
+    Needs the optional `redis` package. Values are pickled, so only point it
+    at a Redis instance you trust.
+    """
+
+    def __init__(self, url, prefix="retrieval"):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("RETRIEVAL_CACHE_URL needs the 'redis' package: pip install redis") from e
+        self.redis = redis.from_url(url)
+        self.prefix = prefix
+
+    async def get(self, key):
+        value = await self.redis.get(f"{self.prefix}:{key}")
+        return pickle.loads(value) if value is not None else None
+
+    async def set(self, key, value, ttl):
+        await self.redis.set(f"{self.prefix}:{key}", pickle.dumps(value), ex=max(1, int(ttl)))
+
+    async def clear(self):
+        # Keys embed the index version, so stale entries are never read again and expire on their own
+        pass
+
+    def size(self):
+        return None  # not tracked for a shared backend
+
+
+class RetrievalCache:
+    """
+    Caches DuckyAI retrieval results by (index, index version, top_k,
+    normalized query) for `ttl` seconds.
+
+    The index version comes from `version_file`, which add_knowledge updates
+    after every run that changed the index. It is re-read at most once per
+    `version_check_interval` seconds. When it changes, entries cached under the
+    old version are no longer used.
+    """
+
+    def __init__(self, backend, ttl, version_file, version_check_interval=1.0):
+        self.backend = backend
+        self.ttl = ttl
+        self.version_file = version_file
+        self.version_check_interval = version_check_interval
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._versions = {}
+        self._version_mtime = ...  # not read yet
+        self._version_checked = 0.0
+
+    async def _index_version(self, index_name):
+        now = time.monotonic()
+        if now - self._version_checked >= self.version_check_interval:
+            self._version_checked = now
+            try:
+                mtime = os.stat(self.version_file).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime != self._version_mtime:
+                if self._version_mtime is not ...:
+                    # Old keys can never match again; clearing just frees their memory
+                    self.invalidations += 1
+                    await self.backend.clear()
+                self._version_mtime = mtime
+                self._versions.clear()
+        if index_name not in self._versions:
+            self._versions[index_name] = read_index_version(self.version_file, index_name)
+        return self._versions[index_name]
+
+    async def _key(self, index_name, top_k, query):
+        version = await self._index_version(index_name)
+        digest = hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+        return f"{index_name}:{version}:{top_k}:{digest}"
+
+    async def get_or_retrieve(self, index_name, query, top_k, retrieve):
+        """Return the cached result, or await `retrieve()` and cache what it returns."""
+        key = await self._key(index_name, top_k, query)
+        result = await self.backend.get(key)
+        if result is not None:
+            self.hits += 1
+            return result
+        self.misses += 1
+        result = await retrieve()
+        await self.backend.set(key, result, self.ttl)
+        return result
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "entries": self.backend.size(),
+            "invalidations": self.invalidations,
+        }
+
+
+def retrieval_cache_from_env():
+    """Build the cache from RETRIEVAL_CACHE_* settings; None when caching is disabled."""
+    size = int(os.getenv("RETRIEVAL_CACHE_SIZE", "1024"))
+    if size <= 0:
+        return None
+    url = os.getenv("RETRIEVAL_CACHE_URL")
+    backend = RedisBackend(url) if url else MemoryBackend(size)
+    return RetrievalCache(
+        backend,
+        ttl=float(os.getenv("RETRIEVAL_CACHE_TTL_SECONDS", "300")),
+        version_file=os.getenv("DUCKY_INDEX_VERSION_FILE", "data/index_version.json"),
+    )
@@ -16,19 +16,59 @@ function addMessage(text, role) {
   const chat = document.getElementById("chat");
   chat.appendChild(wrapper);
   chat.scrollTop = chat.scrollHeight;
+  return bubble;
+}
+
+/**
+ * Read Server-Sent Events from a fetch() response.
+ * Calls onEvent(event, data) for every complete event.
+ */
+async function readEvents(res, onEvent) {
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let end;
+    while ((end = buffer.indexOf("\n\n")) !== -1) {
+      const raw = buffer.slice(0, end);
+      buffer = buffer.slice(end + 2);
+      let event = "message";
+      let data = "";
+      for (const line of raw.split("\n")) {
+        if (line.startsWith("event: ")) event = line.slice(7);
+        else if (line.startsWith("data: ")) data += line.slice(6);
+      }
+      onEvent(event, data ? JSON.parse(data) : {});
+    }
+  }
 }
 
 async function sendMessage(text) {
   addMessage(text, "user");
   try {
-    const res = await fetch("http://localhost:8000/chat", {
+    // Stream the reply so it appears as soon as the first tokens are generated
+    const res = await fetch("http://localhost:8000/chat/stream", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
       body: JSON.stringify({ message: text })
     });
-    const data = await res.json();
-    const reply = data.reply || data.response || data.message || JSON.stringify(data);
-    addMessage(reply, "bot");
+    if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`);
+    let reply = "";
+    let bubble = null;
+    await readEvents(res, (event, data) => {
+      if (event === "error") {
+        addMessage(`❌ Error: ${data.error}`, "bot");
+      } else if (data.token) {
+        reply += data.token;
+        bubble = bubble || addMessage("", "bot");
+        bubble.innerHTML = marked.parse(reply);
+        const chat = document.getElementById("chat");
+        chat.scrollTop = chat.scrollHeight;
+      }
+    });
   } catch (err) {
     addMessage(`❌ Error: ${err.message}`, "bot");
   }
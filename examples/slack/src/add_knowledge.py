@@ -6,6 +6,26 @@ import os
 from dotenv import load_dotenv
 # Import json for loading JSON data
 import json
+# Import argparse for command-line options
+import argparse
+# Import the manifest used to skip documents that have not changed since the last run
+from manifest import IndexManifest, content_hash, delete_missing_documents, stable_doc_id
+# Import the progress log that makes interrupted runs resumable
+from progress_log import ProgressLog
+# Import the index version used to invalidate the apps' retrieval caches
+from retrieval_cache import bump_index_version
+
+# Parse command-line options
+parser = argparse.ArgumentParser(description="Index Slack channel history into DuckyAI")
+parser.add_argument("--delete-missing", action="store_true",
+                    help="delete documents whose message no longer appears in the export")
+parser.add_argument("--resume", action="store_true",
+                    help="continue an interrupted run from the first thread that was not fully indexed")
+parser.add_argument("--input", default="data/channel_history_enriched.jsonl",
+                    help="JSON Lines export written by fetch_slack.py (one thread per line)")
+args = parser.parse_args()
+if args.resume and args.delete_missing:
+    parser.error("--delete-missing needs a complete pass over the export and cannot be combined with --resume")
 
 # Load environment variables from .env file
 load_dotenv(override=True)
@@ -21,59 +41,138 @@ if ducky_index_name is None:
     raise ValueError("DUCKY_INDEX_NAME environment variable not set")
 
 # Define the path to the channel history file
-channel_history_file_path = "data/channel_history_enriched.json"
-
-# Initialize an empty string to store the channel history content
-channel_history_content = ""
-# Open the channel_history_enriched.json file in read mode with utf-8 encoding
-with open(channel_history_file_path, 'r', encoding='utf-8') as f:
-    json_data = json.load(f)
-    seen = set()
-    for idx, msg in enumerate(json_data):
-        # Skip empty or system messages
-        text = msg.get("text", "").strip() if "text" in msg else ""
-        if not text or "has joined the channel" in text or "has left the channel" in text:
-            continue
-        # Deduplication by text and timestamp
-        dedup_key = (text, msg.get("timestamp"))
-        if dedup_key in seen:
-            continue
-        seen.add(dedup_key)
-        # Metadata enrichment
-        metadata = {
-            "timestamp": msg.get("timestamp"),
-            "author": msg.get("name"),
-            "thread_id": f"thread_{idx}",
-            "type": "message"
-        }
-        # Index the main message
+channel_history_file_path = args.input
+# Threads exported before fetch_slack.py recorded their channel are attributed to the file they came from
+default_channel = os.path.splitext(os.path.basename(channel_history_file_path))[0]
+
+# The manifest remembers the content hash of every document indexed so far, per export file,
+# so --delete-missing only removes messages that came from the file being ingested.
+# Rows from before the manifest tracked files belong to the default export.
+manifest = IndexManifest(
+    os.getenv("DUCKY_MANIFEST_PATH", "data/index_manifest.db"), ducky_index_name,
+    source=os.path.normpath(channel_history_file_path),
+    legacy_source=os.path.normpath(parser.get_default("input")),
+)
+
+
+def read_threads(path, offset=None, start_row=0):
+    """
+    Yield (row, thread, next_offset) for each line of a JSON Lines export,
+    reading one line at a time so memory does not grow with the file.
+    `next_offset` is the byte position right after the line, for --resume.
+    """
+    with open(path, "rb") as f:
+        if offset is not None:
+            f.seek(offset)
+        row = start_row
+        for line in iter(f.readline, b""):
+            if line.strip():
+                yield row, json.loads(line), f.tell()
+                row += 1
+
+
+def index_thread(msg):
+    """Index a top-level message and its replies. Returns (indexed doc IDs, number skipped as unchanged)."""
+    indexed = []
+    skipped = 0
+    # Skip empty or system messages
+    text = msg.get("text", "").strip() if "text" in msg else ""
+    if not text or "has joined the channel" in text or "has left the channel" in text:
+        return indexed, skipped
+    # Metadata enrichment
+    # Timestamps are only unique within a channel: every ID includes the channel the thread came from
+    channel = msg.get("channel") or default_channel
+    # thread_id is derived from the parent timestamp so it stays the same as the export grows
+    thread_id = stable_doc_id("thread", channel, msg.get("timestamp"))
+    metadata = {
+        "timestamp": msg.get("timestamp"),
+        "author": msg.get("name"),
+        "thread_id": thread_id,
+        "type": "message"
+    }
+    # Index the main message, unless its indexed copy is already up to date
+    # Edited messages are re-indexed under the same doc_id
+    doc_id = stable_doc_id("slack-msg", channel, msg.get("timestamp"))
+    # Deduplicate by doc_id (derived from channel and timestamp) rather than keeping every message text in memory
+    if doc_id in seen:
+        return indexed, skipped
+    seen.add(doc_id)
+    doc_hash = content_hash(text, metadata)
+    if manifest.is_unchanged(doc_id, doc_hash):
+        skipped += 1
+    else:
         client.documents.index(
             index_name=ducky_index_name,
             content=text,
             metadata=metadata,
+            doc_id=doc_id,
         )
-        # Handle sub-messages if present
-        for sub in msg.get("sub-messages", []):
-            sub_text = sub.get("text", "").strip()
-            if not sub_text:
-                continue
-            sub_dedup_key = (sub_text, sub.get("timestamp"))
-            if sub_dedup_key in seen:
-                continue
-            seen.add(sub_dedup_key)
-            sub_metadata = {
-                "timestamp": sub.get("timestamp"),
-                "author": sub.get("name"),
-                "parent_id": msg.get("timestamp"),
-                "thread_id": f"thread_{idx}",
-                "type": "reply"
-            }
-            # Optionally prepend parent text for context
-            content = f"Context: {text}\nReply: {sub_text}"
-            client.documents.index(
-                index_name=ducky_index_name,
-                content=content,
-                metadata=sub_metadata,
-            )
+        manifest.record(doc_id, doc_hash)
+        indexed.append(doc_id)
+    # Handle sub-messages if present
+    for sub in msg.get("sub-messages", []):
+        sub_text = sub.get("text", "").strip()
+        if not sub_text:
+            continue
+        sub_metadata = {
+            "timestamp": sub.get("timestamp"),
+            "author": sub.get("name"),
+            "parent_id": msg.get("timestamp"),
+            "thread_id": thread_id,
+            "type": "reply"
+        }
+        # Optionally prepend parent text for context
+        content = f"Context: {text}\nReply: {sub_text}"
+        sub_doc_id = stable_doc_id("slack-reply", channel, msg.get("timestamp"), sub.get("timestamp"))
+        if sub_doc_id in seen:
+            continue
+        seen.add(sub_doc_id)
+        sub_doc_hash = content_hash(content, sub_metadata)
+        if manifest.is_unchanged(sub_doc_id, sub_doc_hash):
+            skipped += 1
+            continue
+        client.documents.index(
+            index_name=ducky_index_name,
+            content=content,
+            metadata=sub_metadata,
+            doc_id=sub_doc_id,
+        )
+        manifest.record(sub_doc_id, sub_doc_hash)
+        indexed.append(sub_doc_id)
+    return indexed, skipped
+
+
+# The progress log records every thread once all of its messages are indexed
+progress = ProgressLog(f"{channel_history_file_path}.progress", channel_history_file_path, resume=args.resume)
+skipped = 0
+changed = 0
+
+# Documents already indexed by the interrupted run count as seen for deduplication
+seen = set(progress.doc_ids)
+
+# Stream the export one thread at a time
+# With --resume, seek straight to the first thread that was not fully indexed
+for idx, thread, next_offset in read_threads(channel_history_file_path, progress.offset, progress.row):
+    indexed, thread_skipped = index_thread(thread)
+    skipped += thread_skipped
+    changed += len(indexed)
+    progress.add_row(idx, next_offset, indexed)
+    # Indexing is synchronous, so everything from this thread is already acknowledged
+    for doc_id in indexed:
+        progress.ack(doc_id)
+progress.close()
+
+print(f"Skipped {skipped} unchanged messages")
+
+# Optionally remove messages that are no longer in the export
+if args.delete_missing:
+    deleted = delete_missing_documents(client, ducky_index_name, manifest)
+    print(f"Deleted {deleted} messages no longer present in {channel_history_file_path}")
+    changed += deleted
+manifest.close()
+
+# Tell running apps to stop serving retrieval results cached before this run
+if changed:
+    bump_index_version(os.getenv("DUCKY_INDEX_VERSION_FILE", "data/index_version.json"), ducky_index_name)
 
 print(f"Successfully indexed chunked and enriched content from {channel_history_file_path} to index {ducky_index_name}")
\ No newline at end of file
@@ -0,0 +1,91 @@
+"""
+Micro-benchmark for the enrichment stage of fetch_slack.py.
+
+Compares the original per-message enrich_message_data (re.sub with a fresh
+closure, datetime per message, sort on ISO strings) with MessageEnricher on
+synthetic messages, checks both produce the same records and prints
+messages/sec for each. Needs no Slack credentials:
+
+    python src/bench_enrich.py --messages 200000
+"""
+import argparse
+import random
+import re
+import time
+from datetime import datetime, timezone
+
+from enrich import MessageEnricher, ts_sort_key
+
+
+def legacy_enrich_message_data(message_dict, users_map):
+    """enrich_message_data as it was before MessageEnricher, kept here as the baseline."""
+    uid = message_dict.get("user")
+    username = users_map.get(uid, "Unknown User") if uid else "Unknown User"
+    message_text = message_dict.get("text", "")
+
+    def replace_mention(match):
+        user_id_mentioned = match.group(1)
+        mentioned_username = users_map.get(user_id_mentioned, user_id_mentioned)
+        return f"@{mentioned_username}"
+
+    message_text = re.sub(r"<@([A-Z0-9]+)(?:\|[a-zA-Z0-9._-]+)?>", replace_mention, message_text)
+    ts_val = message_dict.get("ts")
+    if not ts_val:
+        iso_time = "UNKNOWN_TIMESTAMP"
+    else:
+        try:
+            iso_time = datetime.fromtimestamp(float(ts_val), tz=timezone.utc).isoformat()
+        except ValueError:
+            iso_time = "INVALID_TIMESTAMP"
+    return {"name": username, "text": message_text, "timestamp": iso_time}
+
+
+def make_messages(count, user_count, seed=42):
+    rng = random.Random(seed)
+    user_ids = [f"U{i:08d}" for i in range(user_count)]
+    start = 1_600_000_000
+    messages = []
+    for _ in range(count):
+        ts = f"{start + rng.randrange(150_000_000)}.{rng.randrange(1_000_000):06d}"
+        text = "status update, nothing to see here"
+        if rng.random() < 0.3:
+            text = f"<@{rng.choice(user_ids)}> can you look at this? cc <@{rng.choice(user_ids)}|someone>"
+        messages.append({"user": rng.choice(user_ids), "text": text, "ts": ts})
+    users = {user_id: f"user {user_id[-4:]}" for user_id in user_ids[: user_count * 9 // 10]}
+    return messages, users
+
+
+def run(label, fn, messages):
+    started = time.perf_counter()
+    result = fn(messages)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<10} {len(messages) / elapsed:>12,.0f} messages/sec ({elapsed:.2f}s)")
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Slack message enrichment")
+    parser.add_argument("--messages", type=int, default=200_000)
+    parser.add_argument("--users", type=int, default=5_000)
+    args = parser.parse_args()
+
+    messages, users = make_messages(args.messages, args.users)
+
+    def legacy(batch):
+        enriched = [legacy_enrich_message_data(m, users) for m in batch]
+        enriched.sort(key=lambda x: x["timestamp"])
+        return enriched
+
+    def batched(batch):
+        return MessageEnricher(users).enrich_many(sorted(batch, key=ts_sort_key))
+
+    old, old_elapsed = run("legacy", legacy, messages)
+    new, new_elapsed = run("enricher", batched, messages)
+    # Compare as sets: ISO-string and numeric sorting order fractional/whole seconds differently
+    key = lambda m: (m["timestamp"], m["name"], m["text"])
+    assert sorted(map(key, old)) == sorted(map(key, new)), "enricher output differs from the legacy output"
+    print(f"speedup    {old_elapsed / new_elapsed:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
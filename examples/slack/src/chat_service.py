@@ -0,0 +1,151 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import groq
+from duckyai import DuckyAI
+
+from src.completion_cache import completion_cache_from_env, completion_key
+from src.context_builder import build_context
+from src.retrieval_cache import retrieval_cache_from_env
+
+NO_CONTEXT_REPLY = "Sorry, I don't know how to respond yet."
+
+
+class ChatService:
+    """
+    The retrieve → prompt → generate pipeline, shared in-process by the FastAPI
+    routes and the Slack mention handler, so a mention is answered with a
+    direct call instead of an HTTP request back to our own /chat endpoint.
+
+    Everything is async: retrieval uses the DuckyAI SDK's async methods (or a
+    bounded thread pool for sync-only SDKs) and generation uses AsyncGroq.
+    Pass a SharedTransport to send both over one pooled keep-alive transport.
+    """
+
+    def __init__(self, transport=None):
+        # per-backend timeouts; callers bound the whole request themselves
+        self.ducky_timeout_ms = int(os.getenv("DUCKY_TIMEOUT_MS", "10000"))
+        groq_timeout = float(os.getenv("GROQ_TIMEOUT_SECONDS", "30"))
+        # documents per question, and how many tokens of them go into the prompt
+        self.top_k = int(os.getenv("DUCKY_TOP_K", "20"))
+        self.context_token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "4000"))
+        self.model = os.getenv("GROQ_MODEL_NAME", "llama3-70b-8192")
+        self.index = os.getenv("DUCKY_INDEX_NAME", "ducky-slack-test")
+
+        # each backend keeps its own timeout on the shared connection pool
+        ducky_http = transport.client(self.ducky_timeout_ms / 1000) if transport else None
+        groq_http  = transport.client(groq_timeout) if transport else None
+        self.client = DuckyAI(api_key=os.getenv("DUCKY_API_KEY"), async_client=ducky_http)
+        # async client: awaiting a completion frees the event loop for other chats
+        self.groq = groq.AsyncGroq(api_key=os.getenv("GROQ_API_KEY"), timeout=groq_timeout, http_client=groq_http)
+        # only used when the installed duckyai SDK has no async methods
+        self.retrieval_pool = ThreadPoolExecutor(max_workers=int(os.getenv("DUCKY_RETRIEVAL_WORKERS", "16")))
+        # recent retrieval results, keyed on index/top_k/normalized query (RETRIEVAL_CACHE_SIZE=0 disables)
+        self.retrieval_cache = retrieval_cache_from_env()
+        # opt-in disk cache of Groq replies per (model, context, question) (COMPLETION_CACHE_SIZE enables)
+        self.completion_cache = completion_cache_from_env()
+
+    async def retrieve(self, query, top_k):
+        """Cached DuckyAI retrieval; repeated questions skip the round trip."""
+        if self.retrieval_cache is None:
+            return await self.retrieve_uncached(query, top_k)
+        return await self.retrieval_cache.get_or_retrieve(
+            self.index, query, top_k, lambda: self.retrieve_uncached(query, top_k)
+        )
+
+    async def retrieve_uncached(self, query, top_k):
+        """DuckyAI retrieval that never blocks the event loop."""
+        documents = self.client.documents
+        if hasattr(documents, "retrieve_async"):
+            return await documents.retrieve_async(
+                index_name=self.index, query=query, top_k=top_k, timeout_ms=self.ducky_timeout_ms
+            )
+        # sync-only SDKs run on a bounded pool instead
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.retrieval_pool,
+            functools.partial(documents.retrieve, index_name=self.index, query=query, top_k=top_k),
+        )
+
+    async def build_messages(self, message):
+        """Retrieve context and build the Groq prompt; None when nothing relevant is indexed."""
+        docs = await self.retrieve(message, top_k=self.top_k)
+        if not docs.documents:
+            return None
+        # best chunks across all documents, de-duplicated, up to the token budget
+        ctx = build_context(docs, message, self.context_token_budget)
+        return [
+            {"role": "system",
+             "content": f"You are a Slack assistant. Consider the entire conversation history from this Slack channel to provide a relevant and helpful answer. Conversation history: {ctx}"},
+            {"role": "user", "content": message}
+        ]
+
+    async def cached_reply(self, messages):
+        """(cache key, earlier reply to the same model/context/question); (None, None) when caching is off."""
+        if self.completion_cache is None:
+            return None, None
+        key = completion_key(self.model, messages[0]["content"], messages[-1]["content"])
+        return key, await self.completion_cache.get(key)
+
+    async def answer(self, message):
+        """The whole reply to one chat message."""
+        messages = await self.build_messages(message)
+        if messages is None:
+            return NO_CONTEXT_REPLY
+        key, reply = await self.cached_reply(messages)
+        if reply is not None:
+            return reply
+        completion = await self.groq.chat.completions.create(model=self.model, messages=messages)
+        reply = completion.choices[0].message.content
+        if key is not None:
+            await self.completion_cache.set(key, self.model, reply)
+        return reply
+
+    async def stream_answer(self, message, timeout):
+        """Like answer(), but yields the reply in pieces as Groq generates it, within `timeout` seconds overall."""
+        loop      = asyncio.get_running_loop()
+        deadline  = loop.time() + timeout
+        remaining = lambda: max(0.0, deadline - loop.time())   # what's left of the request budget
+
+        messages = await asyncio.wait_for(self.build_messages(message), remaining())
+        if messages is None:
+            yield NO_CONTEXT_REPLY
+            return
+        key, reply = await asyncio.wait_for(self.cached_reply(messages), remaining())
+        if reply is not None:
+            yield reply            # a cached reply goes out as one chunk
+            return
+        stream = await asyncio.wait_for(
+            self.groq.chat.completions.create(model=self.model, messages=messages, stream=True),
+            remaining()
+        )
+        tokens = []
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(anext(stream), remaining())
+                except StopAsyncIteration:
+                    break
+                token = chunk.choices[0].delta.content if chunk.choices else None
+                if token:
+                    tokens.append(token)
+                    yield token
+            if key is not None:    # only replies that streamed to the end are cached
+                await self.completion_cache.set(key, self.model, "".join(tokens))
+        finally:
+            await stream.close()   # closing the response stops generation if the client left
+
+    def cache_stats(self):
+        return {
+            "retrieval":  self.retrieval_cache.stats() if self.retrieval_cache else None,
+            "completion": self.completion_cache.stats() if self.completion_cache else None,
+        }
+
+    async def close(self):
+        """Drop queued retrievals and close Groq's connection pool and the completion cache."""
+        self.retrieval_pool.shutdown(wait=False, cancel_futures=True)
+        await self.groq.close()
+        if self.completion_cache is not None:
+            self.completion_cache.close()
@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def completion_key(model, system_prompt, message):
+    """Key a completion by model, a hash of the system prompt (which embeds the retrieved context) and the message."""
+    context_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+    raw = json.dumps([model, context_hash, " ".join(message.split())])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """
+    Persistent cache of Groq replies, so an identical question asked against
+    identical retrieved context is answered without calling the model again.
+
+    Replies live in a local SQLite file and survive restarts. At most
+    `max_entries` are kept; the least recently used are evicted first.
+    Lookups run on a worker thread so disk I/O never blocks the event loop.
+    """
+
+    def __init__(self, path, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                " key TEXT PRIMARY KEY,"
+                " model TEXT NOT NULL,"
+                " reply TEXT NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS completions_last_used ON completions (last_used)")
+        self._entries = self.conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        # The limit may be smaller than on the last run; trim right away
+        self._evict()
+
+    def _get(self, key):
+        with self._lock:
+            row = self.conn.execute("SELECT reply FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self.conn:
+                self.conn.execute("UPDATE completions SET last_used = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def _set(self, key, model, reply):
+        with self._lock:
+            existed = self.conn.execute("SELECT 1 FROM completions WHERE key = ?", (key,)).fetchone()
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO completions (key, model, reply, last_used) VALUES (?, ?, ?, ?)",
+                    (key, model, reply, time.time()),
+                )
+            if not existed:
+                self._entries += 1
+            self._evict()
+
+    def _evict(self):
+        excess = self._entries - self.max_entries
+        if excess > 0:
+            with self.conn:
+                self.conn.execute(
+                    "DELETE FROM completions WHERE key IN"
+                    " (SELECT key FROM completions ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+            self._entries -= excess
+            self.evictions += excess
+
+    async def get(self, key):
+        """Return the cached reply for `key`, or None."""
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key, model, reply):
+        await asyncio.to_thread(self._set, key, model, reply)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "entries": self._entries,
+            "evictions": self.evictions,
+        }
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+def completion_cache_from_env():
+    """Build the cache from COMPLETION_CACHE_* settings; None unless COMPLETION_CACHE_SIZE is set."""
+    size = int(os.getenv("COMPLETION_CACHE_SIZE", "0"))
+    if size <= 0:
+        return None
+    return CompletionCache(os.getenv("COMPLETION_CACHE_FILE", "data/completion_cache.db"), size)
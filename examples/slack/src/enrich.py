@@ -0,0 +1,95 @@
+import re
+from datetime import datetime, timezone
+
+# <@USERID> or <@USERID|fallback_name>; Slack sometimes includes a fallback name like <@U123ABC|john.doe>
+MENTION_PATTERN = re.compile(r"<@([A-Z0-9]+)(?:\|[a-zA-Z0-9._-]+)?>")
+SECONDS_PER_DAY = 86400
+# "HH:MM:SS" for every second of a day, built once so timestamps are formatted by lookup
+TIMES_OF_DAY = [f"{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}" for s in range(SECONDS_PER_DAY)]
+
+
+def ts_sort_key(message):
+    """Sort key for raw Slack messages: the numeric value of `ts` (missing/invalid sort first)."""
+    try:
+        return float(message.get("ts") or 0)
+    except ValueError:
+        return 0.0
+
+
+class MessageEnricher:
+    """
+    Turns raw Slack messages into the {name, text, timestamp} records written
+    to the export, for whole batches at a time.
+
+    Everything that does not depend on the message is done once: the mention
+    regex is compiled at import, every user ID is resolved against `users`
+    (a dict or UserDirectory) once and its replacement text memoized, and the
+    date part of the ISO timestamp is computed once per UTC day, with the time
+    of day looked up in a table built at import.
+    """
+
+    def __init__(self, users):
+        self.users = users
+        self._names = {}     # user ID → name, or None when unknown
+        self._mentions = {}  # user ID → "@name" replacement text
+        self._days = {}      # days since the epoch → "YYYY-MM-DDT"
+
+    def name(self, user_id):
+        name = self._names.get(user_id, ...)
+        if name is ...:
+            name = self._names[user_id] = self.users.get(user_id)
+        return name
+
+    def _mention(self, match):
+        user_id = match.group(1)
+        replacement = self._mentions.get(user_id)
+        if replacement is None:
+            # Fallback to ID if not found
+            replacement = self._mentions[user_id] = f"@{self.name(user_id) or user_id}"
+        return replacement
+
+    def iso_timestamp(self, ts_val, message=None):
+        """Same output as datetime.fromtimestamp(float(ts), tz=timezone.utc).isoformat()."""
+        if not ts_val:
+            print(f"Warning: Message missing 'ts' field. Client Msg ID: {(message or {}).get('client_msg_id', 'N/A')}")
+            return "UNKNOWN_TIMESTAMP"
+        seconds, _, fraction = ts_val.partition(".")
+        if seconds.isdigit() and len(fraction) <= 6 and (fraction.isdigit() or not fraction):
+            day, second_of_day = divmod(int(seconds), SECONDS_PER_DAY)
+            date = self._days.get(day)
+            if date is None:
+                date = self._days[day] = datetime.fromtimestamp(day * SECONDS_PER_DAY, tz=timezone.utc).strftime("%Y-%m-%dT")
+            micros = fraction.ljust(6, "0")
+            if micros == "000000":
+                return f"{date}{TIMES_OF_DAY[second_of_day]}+00:00"
+            return f"{date}{TIMES_OF_DAY[second_of_day]}.{micros}+00:00"
+        # Anything unusual (negative, exponent, extra precision) goes through datetime
+        try:
+            return datetime.fromtimestamp(float(ts_val), tz=timezone.utc).isoformat()
+        except (ValueError, OverflowError, OSError):
+            print(f"Warning: Invalid 'ts' value '{ts_val}'. Client Msg ID: {(message or {}).get('client_msg_id', 'N/A')}")
+            return "INVALID_TIMESTAMP"
+
+    def enrich(self, message):
+        return self.enrich_many([message])[0]
+
+    def enrich_many(self, messages):
+        """Enrich a batch of messages, keeping their order."""
+        # Hoist attribute lookups out of the loop; this runs once per exported message
+        names, name, mention, sub, iso = self._names, self.name, self._mention, MENTION_PATTERN.sub, self.iso_timestamp
+        enriched = []
+        for message in messages:
+            uid = message.get("user")
+            username = names.get(uid, ...) if uid else None
+            if username is ...:
+                username = name(uid)
+            text = message.get("text", "")
+            # Most messages mention nobody, so skip the regex for them
+            if "<@" in text:
+                text = sub(mention, text)
+            enriched.append({
+                "name": username or "Unknown User",
+                "text": text,
+                "timestamp": iso(message.get("ts"), message),
+            })
+        return enriched
@@ -1,231 +1,423 @@
-import os, time, json, re # Added re for regex operations
+import os, time, json, threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
 from dotenv import load_dotenv
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
 
+from enrich import MessageEnricher, ts_sort_key
+from rate_limiter import call_with_retry, per_minute_limiter
+from user_directory import UserDirectory, user_display_name
+
 load_dotenv(override=True)  # take environment variables from .env and override existing ones.
 
 PAGE_LIMIT = int(os.getenv("PAGE_LIMIT", "200"))  # Slack allows up to 1000 for history
 LAST_N = int(os.getenv("LAST_N", "0"))  # 0 means fetch everything
+REPLY_WORKERS = int(os.getenv("REPLY_WORKERS", "4"))  # threads fetching thread replies in parallel
+CHANNEL_WORKERS = int(os.getenv("CHANNEL_WORKERS", "2"))  # channels exported at the same time
+# conversations.history and conversations.replies are Tier 3 methods (50+ requests/minute)
+TIER3_PER_MINUTE = int(os.getenv("SLACK_TIER3_PER_MINUTE", "50"))
+# users.info is Tier 4 (100+ requests/minute)
+TIER4_PER_MINUTE = int(os.getenv("SLACK_TIER4_PER_MINUTE", "100"))
+# Resolved user names are cached here between runs
+USER_CACHE_FILE = os.getenv("SLACK_USER_CACHE_FILE", "data/slack_users.db")
+USER_CACHE_TTL_HOURS = float(os.getenv("SLACK_USER_CACHE_TTL_HOURS", "24"))
+# Page through the whole users.list up front instead of resolving users on demand
+USER_PREFETCH = os.getenv("SLACK_USER_PREFETCH", "false").lower() in ("1", "true", "yes")
+# "full" re-exports the whole channel; "incremental" only fetches what changed since the last run
+SYNC_MODE = os.getenv("SYNC_MODE", "full")
+SYNC_STATE_FILE = os.getenv("SYNC_STATE_FILE", "data/slack_sync_state.json")
+# In incremental mode, threads whose parent is newer than this are re-checked for new replies
+THREAD_LOOKBACK_DAYS = float(os.getenv("THREAD_LOOKBACK_DAYS", "14"))
+OUTPUT_PATH = "data/channel_history_enriched.jsonl"
+# Multi-channel exports write one file per channel plus a manifest into this directory
+CHANNELS_OUTPUT_DIR = os.getenv("CHANNELS_OUTPUT_DIR", "data/channels")
 print("last_n:", LAST_N)  # DEBUG
 print("Script starting...") # DEBUG
 
 SLACK_TOKEN = os.getenv("SLACK_BOT_TOKEN")          # xoxb-…
 CHANNEL_ID  = os.getenv("CHANNEL_ID")               # starts with C/G/D
+# Comma-separated channel IDs, or "all" for every channel the bot has joined
+CHANNEL_IDS = os.getenv("CHANNEL_IDS", "").strip()
 print(f"Attempting to use CHANNEL_ID from .env: '{CHANNEL_ID}'") # ADD THIS LINE TO DEBUG
 print(f"SLACK_TOKEN loaded (first 10 chars): '{SLACK_TOKEN[:10] if SLACK_TOKEN else None}...'") # DEBUG
 print(f"LAST_N requested: {LAST_N if LAST_N else 'all'}")  # DEBUG
 
 assert SLACK_TOKEN and SLACK_TOKEN.startswith("xoxb-"), "Missing/invalid SLACK_BOT_TOKEN"
-assert CHANNEL_ID and CHANNEL_ID[0] in "CGD", "Missing/invalid CHANNEL_ID"
+assert CHANNEL_IDS or (CHANNEL_ID and CHANNEL_ID[0] in "CGD"), "Missing/invalid CHANNEL_ID (or set CHANNEL_IDS)"
 
 client        = WebClient(token=SLACK_TOKEN)
+# One limiter shared by the history pager and every reply worker, across all channels
+tier3_limiter = per_minute_limiter(TIER3_PER_MINUTE)
+tier4_limiter = per_minute_limiter(TIER4_PER_MINUTE)
+# Reply workers are shared by every channel; channel workers only wait on them, so the two pools never deadlock
+reply_executor = ThreadPoolExecutor(max_workers=REPLY_WORKERS)
+# Guards sync_state, which every channel worker updates when it finishes
+state_lock = threading.Lock()
 
-def enrich_message_data(message_dict, users_map):
-    uid = message_dict.get("user")
-    username = users_map.get(uid, "Unknown User") if uid else "Unknown User"
-    message_text = message_dict.get("text", "")
-
-    # Replace user mentions (<@USERID>) with @Username
-    def replace_mention(match):
-        user_id_mentioned = match.group(1)
-        mentioned_username = users_map.get(user_id_mentioned, user_id_mentioned) # Fallback to ID if not found
-        return f"@{mentioned_username}"
-
-    # Regex to find all occurrences of <@USERID> or <@USERID|fallback_name>
-    # Slack sometimes includes a fallback name like <@U123ABC|john.doe>
-    # We prioritize the lookup in users_map, but this regex handles both forms.
-    message_text = re.sub(r"<@([A-Z0-9]+)(?:\|[a-zA-Z0-9._-]+)?>", replace_mention, message_text)
-    
-    ts_val = message_dict.get("ts")
-    if not ts_val: 
-        print(f"Warning: Message missing 'ts' field. Client Msg ID: {message_dict.get('client_msg_id', 'N/A')}")
-        iso_time = "UNKNOWN_TIMESTAMP"
-    else:
-        try:
-            iso_time = datetime.fromtimestamp(float(ts_val), tz=timezone.utc).isoformat()
-        except ValueError:
-            print(f"Warning: Invalid 'ts' value '{ts_val}'. Client Msg ID: {message_dict.get('client_msg_id', 'N/A')}")
-            iso_time = "INVALID_TIMESTAMP"
+def fetch_page(channel_id, cursor=None, oldest="0"):
+    # Ensure channel_id is not None before making the API call
+    if not channel_id:
+        raise ValueError("channel_id is not set.")
+    return call_with_retry(
+        client.conversations_history,
+        limiter=tier3_limiter,
+        channel=channel_id,
+        limit=min(PAGE_LIMIT, LAST_N or PAGE_LIMIT),
+        oldest=oldest, # API expects string for 'oldest'
+        cursor=cursor
+    )
 
-    return {
-        "name": username,
-        "text": message_text,
-        "timestamp": iso_time
-    }
-
-def fetch_page(cursor=None):
+def fetch_thread_replies(channel_id, parent_thread_ts):
+    """
+    Fetch every reply in one thread (without the parent), following pagination.
+    Returns (replies, complete); complete is False if a page failed and replies may be missing.
+    """
+    replies = []
+    cursor = None
     while True:
         try:
-            # Ensure CHANNEL_ID is not None before making the API call
-            if not CHANNEL_ID:
-                raise ValueError("CHANNEL_ID is not set.")
-            return client.conversations_history(
-                channel=CHANNEL_ID,
-                limit=min(PAGE_LIMIT, LAST_N or PAGE_LIMIT),
-                oldest="0", # API expects string for 'oldest'
+            replies_resp = call_with_retry(
+                client.conversations_replies,
+                limiter=tier3_limiter,
+                channel=channel_id,
+                ts=parent_thread_ts, # ts of the parent message
+                limit=PAGE_LIMIT,
                 cursor=cursor
             )
         except SlackApiError as e:
-            if e.response["error"] == "ratelimited":
-                retry_after = int(e.response.headers.get("Retry-After", 1))
-                print(f"Rate‑limited → sleeping {retry_after}s")
+            print(f"[{channel_id}] Slack API Error fetching replies for {parent_thread_ts}: {e}")
+            return replies, False
+        except Exception as ex:
+            print(f"[{channel_id}] Unexpected error fetching replies for {parent_thread_ts}: {ex}")
+            return replies, False
+        # conversations_replies includes the parent itself; we only want the actual replies
+        replies.extend(m for m in (replies_resp.get("messages") or []) if m.get("ts") != parent_thread_ts)
+        cursor = replies_resp.get("response_metadata", {}).get("next_cursor")
+        if not cursor:
+            break
+    return replies, True
+
+def is_thread_parent(message):
+    return message.get("thread_ts") == message.get("ts") and message.get("reply_count", 0) > 0
+
+def load_sync_state():
+    if not os.path.exists(SYNC_STATE_FILE):
+        return {}
+    with open(SYNC_STATE_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_sync_state(state):
+    # Write to a temp file and rename so a crash never leaves a half-written state file
+    tmp_path = f"{SYNC_STATE_FILE}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, SYNC_STATE_FILE)
+
+def write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+def discover_channels():
+    """Return {channel_id: name} for every public and private channel the bot is a member of."""
+    channels = {}
+    cursor = None
+    while True:
+        # users.conversations is also Tier 3, so it draws from the same budget
+        resp = call_with_retry(
+            client.users_conversations,
+            limiter=tier3_limiter,
+            types="public_channel,private_channel",
+            exclude_archived=True,
+            limit=200,
+            cursor=cursor
+        )
+        for channel in (resp.get("channels") or []):
+            channels[channel["id"]] = channel.get("name")
+        cursor = resp.get("response_metadata", {}).get("next_cursor")
+        if not cursor:
+            break
+    return channels
+
+def fetch_users():
+    """Build a user-ID → name map for the whole workspace (only with SLACK_USER_PREFETCH)."""
+    users = {}
+    print("Fetching user list...") # DEBUG
+    cursor = None
+    while True:
+        try:
+            response = client.users_list(limit=200, cursor=cursor)
+
+            # Iterate safely over members, defaulting to an empty list if "members" is None or missing
+            for u in (response.get("members") or []):
+                users[u["id"]] = user_display_name(u) # Fallback chain for user name
+
+            cursor = response.get("response_metadata", {}).get("next_cursor")
+            if not cursor:
+                break
+        except SlackApiError as e:
+            # More robustly check for rate-limiting error
+            is_ratelimited = False
+            error_message = str(e) # Default error message
+            if e.response and hasattr(e.response, 'get') and e.response.get("error") == "ratelimited":
+                is_ratelimited = True
+                error_message = "ratelimited" # Specific message for this case
+
+            if is_ratelimited:
+                retry_after = 1 # Default retry
+                if hasattr(e.response, 'headers') and isinstance(e.response.headers, dict):
+                     retry_after = int(e.response.headers.get("Retry-After", 1))
+                print(f"Rate‑limited while fetching users → sleeping {retry_after}s")
                 time.sleep(retry_after)
             else:
-                raise
-
-all_msgs, cursor = [], None
-print("Starting to fetch messages...") # DEBUG
-while True:
-    print(f"Current cursor: {cursor}, Total messages so far: {len(all_msgs)}") # DEBUG
-    resp = fetch_page(cursor)
-
-    # Initialize as an empty list. This variable will hold messages from the current page.
-    current_page_messages_list: list = []
-
-    if resp is not None:
-        api_messages_field = resp.get("messages") # Attempt to get the 'messages' field
-        if isinstance(api_messages_field, list):
-            # If 'messages' is a list, use it
-            current_page_messages_list = api_messages_field
-        else:
-            # If api_messages_field is None (key not found) or not a list,
-            # current_page_messages_list remains []. Log if it was an unexpected type.
-            if api_messages_field is not None:
-                print(f"Warning: 'messages' field from API was not a list, but {type(api_messages_field)}. Treating as no messages for this page.")
-    else:
-        # If resp is None, current_page_messages_list remains [].
-        print("Warning: fetch_page returned None. Treating as no messages for this page.")
-
-    if not current_page_messages_list: # Log if the list for the current page is empty
-        print("No messages in this page.") # DEBUG
-    
-    all_msgs.extend(current_page_messages_list) # current_page_messages_list is guaranteed to be a list here.
-    
-    # Stop early if we have enough messages
-    if LAST_N and len(all_msgs) >= LAST_N:
-        all_msgs = all_msgs[:LAST_N]  # keep only the newest N
-        print(f"Reached LAST_N={LAST_N}. Exiting fetch loop early.")  # DEBUG
-        break
-    time.sleep(0.5)  # gentle throttle; adjust via PAGE_LIMIT if needed
-    cursor = resp.get("response_metadata", {}).get("next_cursor", "")
-    print(f"Extended messages. New total: {len(all_msgs)}, Next cursor: '{cursor}'") # DEBUG
-    if not cursor:
-        print("No more pages. Exiting fetch loop.") # DEBUG
-        break
-
-# ── Build a user‑ID → name map ──────────────────────────────
-users = {}
-print("Fetching user list...") # DEBUG
-cursor = None
-while True:
-    try:
-        response = client.users_list(limit=200, cursor=cursor)
-        
-        # Iterate safely over members, defaulting to an empty list if "members" is None or missing
-        for u in (response.get("members") or []):
-            profile = u.get("profile", {})  # Ensure profile is a dict, default to empty if missing
-            display_name = profile.get("display_name")
-            real_name = profile.get("real_name")
-            users[u["id"]] = display_name or real_name or u.get("name") or u.get("id") # Fallback chain for user name
-
-        cursor = response.get("response_metadata", {}).get("next_cursor")
-        if not cursor:
+                print(f"Error fetching users (SlackApiError): {error_message}")
+                break
+        except Exception as ex: # Catch any other unexpected errors during user fetching
+            print(f"Unexpected error fetching users: {ex}")
             break
-    except SlackApiError as e:
-        # More robustly check for rate-limiting error
-        is_ratelimited = False
-        error_message = str(e) # Default error message
-        if e.response and hasattr(e.response, 'get') and e.response.get("error") == "ratelimited":
-            is_ratelimited = True
-            error_message = "ratelimited" # Specific message for this case
-
-        if is_ratelimited:
-            retry_after = 1 # Default retry
-            if hasattr(e.response, 'headers') and isinstance(e.response.headers, dict):
-                 retry_after = int(e.response.headers.get("Retry-After", 1))
-            print(f"Rate‑limited while fetching users → sleeping {retry_after}s")
-            time.sleep(retry_after)
+    print(f"User list fetched. Total users: {len(users)}") # DEBUG
+    return users
+
+def iter_history_pages(channel_id, oldest, incremental):
+    """Yield conversations.history one page at a time (newest first), so the channel is never held in memory."""
+    cursor = None
+    total = 0
+    print(f"[{channel_id}] Starting to fetch messages...") # DEBUG
+    while True:
+        print(f"[{channel_id}] Current cursor: {cursor}, Total messages so far: {total}") # DEBUG
+        resp = fetch_page(channel_id, cursor, oldest=oldest)
+
+        # Initialize as an empty list. This variable will hold messages from the current page.
+        current_page_messages_list: list = []
+
+        if resp is not None:
+            api_messages_field = resp.get("messages") # Attempt to get the 'messages' field
+            if isinstance(api_messages_field, list):
+                # If 'messages' is a list, use it
+                current_page_messages_list = api_messages_field
+            else:
+                # If api_messages_field is None (key not found) or not a list,
+                # current_page_messages_list remains []. Log if it was an unexpected type.
+                if api_messages_field is not None:
+                    print(f"Warning: 'messages' field from API was not a list, but {type(api_messages_field)}. Treating as no messages for this page.")
         else:
-            print(f"Error fetching users (SlackApiError): {error_message}")
-            break 
-    except Exception as ex: # Catch any other unexpected errors during user fetching
-        print(f"Unexpected error fetching users: {ex}")
-        break
-print(f"User list fetched. Total users: {len(users)}") # DEBUG
-
-# ── Enrich messages and fetch replies with NESTED structure ───────────
-final_structured_messages = []
-print("Starting message enrichment and fetching replies for NESTED structure...") # DEBUG
-
-for m_parent_raw in all_msgs:  # all_msgs might have been sliced by LAST_N
-    enriched_parent_msg = enrich_message_data(m_parent_raw, users)
-
-    is_thread_parent = m_parent_raw.get("thread_ts") == m_parent_raw.get("ts") and m_parent_raw.get("reply_count", 0) > 0
-
-    if is_thread_parent:
-        print(f"Fetching replies for thread parent: {m_parent_raw.get('ts')}") # DEBUG
-        replies_for_parent = []
-        thread_replies_cursor = None
-        parent_thread_ts = m_parent_raw.get("thread_ts")
-
-        if not parent_thread_ts:
-            print(f"Warning: Thread parent {m_parent_raw.get('ts')} missing thread_ts. Skipping replies.") # DEBUG
+            # If resp is None, current_page_messages_list remains [].
+            print("Warning: fetch_page returned None. Treating as no messages for this page.")
+
+        if not current_page_messages_list: # Log if the list for the current page is empty
+            print(f"[{channel_id}] No messages in this page.") # DEBUG
+
+        # Stop early if we have enough messages (LAST_N only applies to full exports)
+        if LAST_N and not incremental and total + len(current_page_messages_list) >= LAST_N:
+            yield current_page_messages_list[:LAST_N - total]  # keep only the newest N
+            print(f"[{channel_id}] Reached LAST_N={LAST_N}. Exiting fetch loop early.")  # DEBUG
+            return
+        total += len(current_page_messages_list)
+        yield current_page_messages_list
+        cursor = resp.get("response_metadata", {}).get("next_cursor", "") if resp else ""
+        print(f"[{channel_id}] Fetched {total} messages so far, Next cursor: '{cursor}'") # DEBUG
+        if not cursor:
+            print(f"[{channel_id}] No more pages. Exiting fetch loop.") # DEBUG
+            return
+
+def enrich_page(channel_id, messages, enricher):
+    """
+    Yield (raw, enriched, replies_complete) for each message of one page, with thread
+    replies nested as sub-messages. replies_complete is False when fetching a thread's replies failed.
+    """
+    # ── Fetch this page's thread replies in parallel ───────────────
+    thread_parent_ts = [m.get("thread_ts") for m in messages if is_thread_parent(m)]
+    # map() keeps results in input order, so the output doesn't depend on which thread finishes first
+    replies = reply_executor.map(lambda ts: fetch_thread_replies(channel_id, ts), thread_parent_ts)
+    replies_by_parent = dict(zip(thread_parent_ts, replies))
+
+    # ── Enrich the whole page at once and attach replies with NESTED structure ───────────
+    for m_parent_raw, enriched_parent_msg in zip(messages, enricher.enrich_many(messages)):
+        if is_thread_parent(m_parent_raw):
+            parent_thread_ts = m_parent_raw.get("thread_ts")
+            raw_replies, complete = replies_by_parent.pop(parent_thread_ts, ([], True))
+            if raw_replies:
+                # Sort on the numeric ts before enriching rather than on the ISO strings afterwards
+                raw_replies.sort(key=ts_sort_key)
+                enriched_parent_msg["sub-messages"] = enricher.enrich_many(raw_replies)
+            yield m_parent_raw, enriched_parent_msg, complete
         else:
-            while True: # Loop for paginating through replies for this specific parent
-                try:
-                    if not CHANNEL_ID:
-                        print("Error: CHANNEL_ID is not set. Cannot fetch replies.") # DEBUG
-                        break
-                    
-                    replies_resp = client.conversations_replies(
-                        channel=CHANNEL_ID,
-                        ts=parent_thread_ts, # ts of the parent message
-                        limit=PAGE_LIMIT, 
-                        cursor=thread_replies_cursor
-                    )
-                    
-                    # The first message in 'messages' list from conversations_replies is the parent itself.
-                    # We only want the actual replies, so we skip the first message.
-                    actual_thread_replies_raw = replies_resp.get("messages", [])[1:] if replies_resp.get("messages") else []
-
-                    for r_reply_raw in actual_thread_replies_raw:
-                        enriched_reply_msg = enrich_message_data(r_reply_raw, users)
-                        replies_for_parent.append(enriched_reply_msg)
-                    
-                    thread_replies_cursor = replies_resp.get("response_metadata", {}).get("next_cursor")
-                    if not thread_replies_cursor:
-                        break # Exit pagination loop for these replies
-                    
-                    time.sleep(0.5) # Gentle throttle
-
-                except SlackApiError as e:
-                    if e.response and e.response.get("error") == "ratelimited":
-                        retry_after = int(e.response.headers.get("Retry-After", 1))
-                        print(f"Rate‑limited fetching replies for {parent_thread_ts} → sleeping {retry_after}s")
-                        time.sleep(retry_after)
-                    else:
-                        print(f"Slack API Error fetching replies for {parent_thread_ts}: {e}")
-                        break 
-                except Exception as ex:
-                    print(f"Unexpected error fetching replies for {parent_thread_ts}: {ex}")
-                    break 
-            
-            if replies_for_parent:
-                replies_for_parent.sort(key=lambda x: x["timestamp"])
-                enriched_parent_msg["sub-messages"] = replies_for_parent
-                print(f"Added {len(replies_for_parent)} sub-messages to parent {parent_thread_ts}") # DEBUG
-
-    final_structured_messages.append(enriched_parent_msg)
-
-# Sort the final list of parent messages by their own timestamp
-final_structured_messages.sort(key=lambda x: x["timestamp"])
-
-print(f"Message enrichment and reply fetching complete. Total parent/standalone messages: {len(final_structured_messages)}") # DEBUG
-
-print(f"Attempting to write {len(final_structured_messages)} structured messages to data/channel_history_enriched.json") # DEBUG
-with open("data/channel_history_enriched.json", "w") as f:
-    json.dump(final_structured_messages, f, indent=2)
-print(f"Saved {len(final_structured_messages)} structured messages to data/channel_history_enriched.json")
\ No newline at end of file
+            yield m_parent_raw, enriched_parent_msg, True
+
+def write_thread(f, thread):
+    # One thread per line (JSON Lines), so readers can stream the export
+    f.write(json.dumps(thread, ensure_ascii=False) + "\n")
+
+def export_channel(channel_id, enricher, output_path, sync_state):
+    """
+    Stream one channel into `output_path` as JSON Lines (one thread per line,
+    oldest first) and record its sync state. Returns a manifest entry.
+    """
+    # ── Decide between a full and an incremental export ─────────────
+    with state_lock:
+        channel_state = sync_state.get(channel_id)
+    incremental = SYNC_MODE == "incremental" and channel_state is not None and os.path.exists(output_path)
+    # Only threads newer than this are ever re-checked, so only they need to be remembered
+    lookback_oldest = max(0.0, time.time() - THREAD_LOOKBACK_DAYS * 86400)
+    history_oldest = "0"
+    if incremental:
+        # Fetch everything after the stored high-water mark, and far enough back to see
+        # thread parents whose latest_reply may have moved since the last run
+        # and to reach threads whose replies could not be fetched last time (stored as None)
+        # (oldest is exclusive, hence the one-second margin)
+        retry_oldest = min((float(ts) - 1 for ts, latest_reply in channel_state["threads"].items() if latest_reply is None),
+                           default=lookback_oldest)
+        history_oldest = f"{min(float(channel_state['latest_ts']), lookback_oldest, retry_oldest):.6f}"
+        print(f"[{channel_id}] Incremental sync: fetching messages after {channel_state['latest_ts']} and re-checking threads since {history_oldest}") # DEBUG
+    else:
+        if SYNC_MODE == "incremental":
+            print(f"[{channel_id}] No previous sync state for this channel; running a full export first.") # DEBUG
+        channel_state = {"latest_ts": "0", "threads": {}}
+    previous_latest_ts = float(channel_state["latest_ts"])
+    known_threads = channel_state["threads"]
+
+    # Newest message seen; becomes the high-water mark for the next incremental run
+    newest_ts = None
+    written = 0
+    # Older threads with new replies, keyed by timestamp; swapped into the existing export below
+    updated_threads = {}
+    thread_state = {}
+    incomplete_threads = 0
+    tmp_path = f"{output_path}.tmp"
+    # Slack lists history newest first. New threads are staged in this file and copied
+    # back in reverse, so the export is oldest first without holding the channel in memory.
+    staged_path = f"{output_path}.new"
+    staged_offsets = []
+    with open(staged_path, "w+", encoding="utf-8") as staged:
+        for page in iter_history_pages(channel_id, history_oldest, incremental):
+            for m in page:
+                if m.get("ts") and (newest_ts is None or float(m["ts"]) > float(newest_ts)):
+                    newest_ts = m["ts"]
+            if incremental:
+                # Keep new messages, plus older thread parents whose replies changed
+                page = [
+                    m for m in page
+                    if float(m.get("ts", 0)) > previous_latest_ts
+                    or (is_thread_parent(m) and known_threads.get(m["ts"]) != m.get("latest_reply"))
+                ]
+            for raw, thread, replies_complete in enrich_page(channel_id, page, enricher):
+                # Message timestamps are only unique within a channel; add_knowledge.py builds doc IDs from both
+                thread["channel"] = channel_id
+                if not replies_complete:
+                    # Don't record latest_reply for a thread with missing replies: None never matches,
+                    # so the next incremental run fetches it again
+                    thread_state[raw["ts"]] = None
+                    incomplete_threads += 1
+                elif is_thread_parent(raw) and (float(raw["ts"]) >= lookback_oldest or raw["ts"] in known_threads):
+                    thread_state[raw["ts"]] = raw.get("latest_reply")
+                if incremental and float(raw.get("ts", 0)) <= previous_latest_ts:
+                    updated_threads[thread["timestamp"]] = thread
+                else:
+                    staged_offsets.append(staged.tell())
+                    write_thread(staged, thread)
+
+        with open(tmp_path, "w", encoding="utf-8") as out:
+            if incremental:
+                print(f"[{channel_id}] {len(staged_offsets)} new messages and {len(updated_threads)} updated threads to export") # DEBUG
+                # Keep the existing export line by line: updated threads replace their old entry
+                with open(output_path, "r", encoding="utf-8") as existing:
+                    for line in existing:
+                        if not line.strip():
+                            continue
+                        thread = updated_threads.pop(json.loads(line).get("timestamp"), None)
+                        if thread is None:
+                            out.write(line if line.endswith("\n") else line + "\n")
+                        else:
+                            write_thread(out, thread)
+                        written += 1
+                for thread in updated_threads.values():
+                    write_thread(out, thread)
+                    written += 1
+            # New threads go last, oldest first
+            for offset in reversed(staged_offsets):
+                staged.seek(offset)
+                out.write(staged.readline())
+                written += 1
+    os.remove(staged_path)
+    # Replace the previous export only once the new one is complete
+    os.replace(tmp_path, output_path)
+    print(f"[{channel_id}] Saved {written} structured messages to {output_path}")
+
+    # ── Record the high-water mark and thread state for the next incremental run ──
+    if newest_ts and float(newest_ts) > previous_latest_ts:
+        channel_state["latest_ts"] = newest_ts
+    # Threads that fell out of the lookback window will never be re-checked, so drop them,
+    # except those whose replies still have to be fetched again
+    channel_state["threads"] = {
+        ts: latest_reply for ts, latest_reply in known_threads.items()
+        if float(ts) >= lookback_oldest or latest_reply is None
+    }
+    channel_state["threads"].update(thread_state)
+    with state_lock:
+        sync_state[channel_id] = channel_state
+        save_sync_state(sync_state)
+    print(f"[{channel_id}] Saved sync state (latest ts {channel_state['latest_ts']}) to {SYNC_STATE_FILE}")
+    if incomplete_threads:
+        print(f"[{channel_id}] Replies of {incomplete_threads} threads could not be fetched completely; "
+              "the next incremental run fetches them again")
+
+    return {
+        "channel_id": channel_id,
+        "path": output_path,
+        "message_count": written,
+        "latest_ts": channel_state["latest_ts"],
+        "sync": "incremental" if incremental else "full",
+    }
+
+# ── Work out which channels to export ───────────────────────────
+if CHANNEL_IDS.lower() == "all":
+    channel_names = discover_channels()
+    print(f"Discovered {len(channel_names)} joined channels") # DEBUG
+elif CHANNEL_IDS:
+    channel_names = {c.strip(): None for c in CHANNEL_IDS.split(",") if c.strip()}
+else:
+    channel_names = {CHANNEL_ID: None}
+multi_channel = bool(CHANNEL_IDS)
+
+# Names are resolved lazily (users.info) for users that appear in the export, and cached between runs
+users = UserDirectory(USER_CACHE_FILE, client, USER_CACHE_TTL_HOURS * 3600, limiter=tier4_limiter)
+if USER_PREFETCH:
+    users.put_many(fetch_users())
+# One enricher for every channel, so resolved names and mention rewrites are shared
+enricher = MessageEnricher(users)
+sync_state = load_sync_state()
+
+try:
+    if not multi_channel:
+        # Single-channel mode keeps the original output file that add_knowledge.py reads
+        export_channel(CHANNEL_ID, enricher, OUTPUT_PATH, sync_state)
+    else:
+        os.makedirs(CHANNELS_OUTPUT_DIR, exist_ok=True)
+        print(f"Exporting {len(channel_names)} channels with {CHANNEL_WORKERS} workers...") # DEBUG
+
+        def export_one(channel_id):
+            output_path = os.path.join(CHANNELS_OUTPUT_DIR, f"{channel_id}.jsonl")
+            try:
+                return export_channel(channel_id, enricher, output_path, sync_state)
+            except Exception as ex:
+                # One inaccessible channel shouldn't lose the others
+                print(f"[{channel_id}] Export failed: {ex}")
+                return {"channel_id": channel_id, "path": output_path, "error": str(ex)}
+
+        with ThreadPoolExecutor(max_workers=CHANNEL_WORKERS) as channel_executor:
+            entries = list(channel_executor.map(export_one, channel_names))
+
+        exported_at = datetime.now(timezone.utc).isoformat()
+        for entry in entries:
+            entry["name"] = channel_names.get(entry["channel_id"])
+        manifest_path = os.path.join(CHANNELS_OUTPUT_DIR, "manifest.json")
+        write_json(manifest_path, {"exported_at": exported_at, "channels": entries})
+        failed = sum(1 for entry in entries if "error" in entry)
+        print(f"Exported {len(entries) - failed}/{len(entries)} channels; manifest written to {manifest_path}")
+finally:
+    reply_executor.shutdown()
+    print(users.stats())
+    users.close()
@@ -0,0 +1,52 @@
+import threading
+import time
+
+from slack_sdk.errors import SlackApiError
+
+
+class TokenBucket:
+    """Thread-safe token bucket shared by every worker calling one Slack rate-limit tier."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def per_minute_limiter(requests_per_minute):
+    """
+    Slack publishes its tiers as requests per minute (Tier 2: 20+, Tier 3: 50+,
+    Tier 4: 100+). Refill evenly with a small burst.
+    """
+    rate = requests_per_minute / 60
+    return TokenBucket(rate=rate, capacity=max(1, requests_per_minute // 10))
+
+
+def call_with_retry(fn, limiter=None, max_retries=5, **kwargs):
+    """Call a WebClient method under `limiter`, sleeping for Retry-After when Slack rate-limits us."""
+    for attempt in range(max_retries + 1):
+        if limiter:
+            limiter.acquire()
+        try:
+            return fn(**kwargs)
+        except SlackApiError as e:
+            if e.response is None or e.response.get("error") != "ratelimited" or attempt == max_retries:
+                raise
+            retry_after = int(e.response.headers.get("Retry-After", 1))
+            print(f"Rate‑limited on {getattr(fn, '__name__', 'Slack call')} → sleeping {retry_after}s")
+            time.sleep(retry_after)
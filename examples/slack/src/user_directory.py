@@ -0,0 +1,103 @@
+import sqlite3
+import threading
+import time
+
+from slack_sdk.errors import SlackApiError
+
+from rate_limiter import call_with_retry
+
+
+# users.info errors that will not change on retry; only these are cached as unknown users
+PERMANENT_ERRORS = {"user_not_found", "user_not_visible"}
+
+
+def user_display_name(user):
+    """Pick the name shown in exports: display name, then real name, then handle, then ID."""
+    profile = user.get("profile") or {}  # Ensure profile is a dict, default to empty if missing
+    return profile.get("display_name") or profile.get("real_name") or user.get("name") or user.get("id")
+
+
+class UserDirectory:
+    """
+    Persistent Slack user-ID → name map shared by every export worker.
+
+    Names are kept in a local SQLite file for `ttl_seconds`. Anything missing or
+    expired is resolved with users.info the first time a message refers to it,
+    so a run only pays for the users that actually appear in the export, not for
+    paging through the whole workspace. Lookups go through get(), so the
+    directory can be passed wherever a plain dict of names was used before.
+    """
+
+    def __init__(self, path, client, ttl_seconds, limiter=None):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.limiter = limiter
+        self.hits = 0
+        self.misses = 0
+        self._names = {}  # IDs resolved during this run, including unknown ones (None)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS users ("
+                " user_id TEXT PRIMARY KEY,"
+                " name TEXT,"
+                " fetched_at REAL NOT NULL)"
+            )
+            self.conn.execute("DELETE FROM users WHERE fetched_at < ?", (time.time() - ttl_seconds,))
+
+    def get(self, user_id, default=None):
+        """Return the name for `user_id`, looking it up in Slack if it isn't cached."""
+        if not user_id:
+            return default
+        name = self._names.get(user_id, ...)
+        if name is ...:
+            name = self._resolve(user_id)
+        return default if name is None else name
+
+    def put_many(self, names):
+        """Store a {user_id: name} map, e.g. from a full users.list prefetch."""
+        now = time.time()
+        with self._lock, self.conn:
+            self._names.update(names)
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO users (user_id, name, fetched_at) VALUES (?, ?, ?)",
+                [(user_id, name, now) for user_id, name in names.items()],
+            )
+
+    def _resolve(self, user_id):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT name FROM users WHERE user_id = ? AND fetched_at >= ?",
+                (user_id, time.time() - self.ttl_seconds),
+            ).fetchone()
+            if row:
+                self.hits += 1
+                self._names[user_id] = row[0]
+                return row[0]
+            self.misses += 1
+        try:
+            response = call_with_retry(self.client.users_info, limiter=self.limiter, user=user_id)
+            name = user_display_name(response.get("user") or {"id": user_id})
+        except SlackApiError as e:
+            error = e.response.get("error") if e.response else None
+            print(f"Could not resolve user {user_id}: {error or e}")
+            if error not in PERMANENT_ERRORS:
+                # Rate limits, internal errors and the like: show the fallback, ask again next time
+                return None
+            # Deleted users and other workspaces' users are cached as unknown so we don't ask again
+            name = None
+        except Exception as e:
+            # Network failures are transient too; nothing is cached
+            print(f"Could not resolve user {user_id}: {e}")
+            return None
+        self.put_many({user_id: name})
+        return name
+
+    def stats(self):
+        total = self.hits + self.misses
+        hit_rate = (self.hits / total * 100) if total else 0.0
+        return f"User cache: {self.hits} hits, {self.misses} users.info lookups ({hit_rate:.1f}% hit rate)"
+
+    def close(self):
+        self.conn.close()